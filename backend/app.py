@@ -1,8 +1,9 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, Form, Query, UploadFile, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import Callable, Iterable, List, Optional, Dict, Any, NamedTuple
+from abc import ABC, abstractmethod
 import os
 import uuid
 import shutil
@@ -10,9 +11,26 @@ from datetime import datetime
 from pathlib import Path
 import fal_client
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageFont, ImageOps
 from dotenv import load_dotenv
 import time
 import random
+import re
+import json
+import hashlib
+import io
+import zipfile
+import threading
+import sqlite3
+import asyncio
+import base64
+import functools
+import contextlib
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 
@@ -36,8 +54,790 @@ UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 PROJECTS_DIR.mkdir(parents=True, exist_ok=True)
 
-# In-memory job storage
-jobs_db: Dict[str, Dict[str, Any]] = {}
+# Jobs are kept for JOB_TTL_SECONDS after they finish. Started jobs that stop
+# making progress for JOB_STALE_SECONDS (e.g. their worker was restarted) are
+# failed; jobs still queued behind other work only once queued for JOB_TTL_SECONDS.
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(24 * 60 * 60)))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", str(60 * 60)))
+JOB_FINISHED_STATUSES = ("completed", "failed")
+
+
+def job_stale_after(status: str) -> int:
+    """Seconds without an update after which an unfinished job is failed"""
+    return JOB_STALE_SECONDS if status == "processing" else JOB_TTL_SECONDS
+
+
+def new_job(job_id: str, total: int) -> Dict[str, Any]:
+    """Initial state of a queued job"""
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "progress": 0,
+        "total_screenshots": total,
+        "completed_screenshots": 0,
+        "results": [],
+        "created_at": datetime.now().isoformat(),
+        "error": None
+    }
+
+
+def apply_progress(job: Dict[str, Any], result: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Count one more finished screenshot on a job dict and return the new counters"""
+    job["completed_screenshots"] += 1
+    job["progress"] = int(job["completed_screenshots"] / max(1, job["total_screenshots"]) * 100)
+    if result is not None:
+        job["results"].append(result)
+    return {"completed_screenshots": job["completed_screenshots"], "progress": job["progress"]}
+
+
+class JobStore(ABC):
+    """Interface for job persistence, see MemoryJobStore and SQLiteJobStore"""
+
+    # Seconds between expiry sweeps run from create()
+    SWEEP_INTERVAL = 60
+
+    @abstractmethod
+    def create(self, job: Dict[str, Any]):
+        pass
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abstractmethod
+    def update(self, job_id: str, **fields):
+        """Atomically set top-level fields of a job"""
+
+    @abstractmethod
+    def add_progress(self, job_id: str, result: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Atomically count a finished screenshot and append its result.
+
+        Returns the updated completed_screenshots/progress counters.
+        """
+
+    @abstractmethod
+    def delete(self, job_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    def list_ids(self, status: Optional[str] = None) -> List[str]:
+        pass
+
+    @abstractmethod
+    def expire(self) -> int:
+        """Drop finished jobs past their TTL and fail stale ones"""
+
+
+class MemoryJobStore(JobStore):
+    """Process-local job store, bounded to max_jobs entries"""
+
+    def __init__(self, max_jobs: int = 10000):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._updated: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def create(self, job):
+        if time.time() - self._last_sweep > self.SWEEP_INTERVAL:
+            self.expire()
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+            self._updated[job["job_id"]] = time.time()
+            # Evict the oldest jobs, finished ones first
+            while len(self._jobs) > self.max_jobs:
+                victim = next((jid for jid, j in self._jobs.items() if j["status"] in JOB_FINISHED_STATUSES), None)
+                victim = victim or next(iter(self._jobs))
+                del self._jobs[victim]
+                del self._updated[victim]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job is not None else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+                self._updated[job_id] = time.time()
+
+    def add_progress(self, job_id, result=None):
+        with self._lock:
+            if job_id in self._jobs:
+                self._updated[job_id] = time.time()
+                return apply_progress(self._jobs[job_id], result)
+            return None
+
+    def delete(self, job_id):
+        with self._lock:
+            self._updated.pop(job_id, None)
+            return self._jobs.pop(job_id, None) is not None
+
+    def list_ids(self, status=None):
+        with self._lock:
+            return [jid for jid, job in self._jobs.items() if status is None or job["status"] == status]
+
+    def expire(self):
+        self._last_sweep = now = time.time()
+        removed = 0
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                age = now - self._updated[job_id]
+                if job["status"] in JOB_FINISHED_STATUSES and age > JOB_TTL_SECONDS:
+                    del self._jobs[job_id]
+                    del self._updated[job_id]
+                    removed += 1
+                elif job["status"] not in JOB_FINISHED_STATUSES and age > job_stale_after(job["status"]):
+                    job.update(status="failed", error="Job stopped making progress")
+                    self._updated[job_id] = now
+        return removed
+
+
+def open_sqlite(path: Path) -> sqlite3.Connection:
+    """SQLite connection in autocommit mode with WAL enabled"""
+    conn = sqlite3.connect(str(path), timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class SQLiteJobStore(JobStore):
+    """Job store shared by every worker process through a WAL-mode SQLite file"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        self._last_sweep = 0.0
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_updated ON jobs (status, updated_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+        return conn
+
+    def _modify(self, job_id: str, change):
+        """Read-modify-write a job inside one write transaction, returning change's result"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            outcome = None
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                job = json.loads(row[0])
+                outcome = change(job)
+                conn.execute(
+                    "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE job_id = ?",
+                    (job["status"], json.dumps(job), time.time(), job_id),
+                )
+            conn.execute("COMMIT")
+            return outcome
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def create(self, job):
+        if time.time() - self._last_sweep > self.SWEEP_INTERVAL:
+            self.expire()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO jobs (job_id, status, data, updated_at) VALUES (?, ?, ?, ?)",
+            (job["job_id"], job["status"], json.dumps(job), time.time()),
+        )
+
+    def get(self, job_id):
+        row = self._conn().execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, job_id, **fields):
+        self._modify(job_id, lambda job: job.update(fields))
+
+    def add_progress(self, job_id, result=None):
+        return self._modify(job_id, lambda job: apply_progress(job, result))
+
+    def delete(self, job_id):
+        return self._conn().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,)).rowcount > 0
+
+    def list_ids(self, status=None):
+        if status is None:
+            rows = self._conn().execute("SELECT job_id FROM jobs")
+        else:
+            rows = self._conn().execute("SELECT job_id FROM jobs WHERE status = ?", (status,))
+        return [row[0] for row in rows]
+
+    def expire(self):
+        self._last_sweep = now = time.time()
+        conn = self._conn()
+        removed = conn.execute(
+            "DELETE FROM jobs WHERE status IN ('completed', 'failed') AND updated_at < ?",
+            (now - JOB_TTL_SECONDS,),
+        ).rowcount
+        stale = conn.execute(
+            "SELECT job_id FROM jobs WHERE (status = 'processing' AND updated_at < ?) "
+            "OR (status NOT IN ('processing', 'completed', 'failed') AND updated_at < ?)",
+            (now - JOB_STALE_SECONDS, now - JOB_TTL_SECONDS),
+        ).fetchall()
+        for (job_id,) in stale:
+            self.update(job_id, status="failed", error="Job stopped making progress")
+        return removed
+
+
+def create_job_store() -> JobStore:
+    """Job store selected by JOB_STORE ("sqlite" or "memory")"""
+    backend = os.getenv("JOB_STORE", "sqlite")
+    if backend == "memory":
+        return MemoryJobStore()
+    if backend == "sqlite":
+        return SQLiteJobStore(USER_DATA_DIR / "jobs.db")
+    raise ValueError(f"Unknown JOB_STORE: {backend}")
+
+
+job_store = create_job_store()
+
+
+class JobEventBus:
+    """Pushes job events to the SSE subscribers of this process.
+
+    publish() may be called from executor threads; events are handed to the
+    event loop that owns the subscriber queues.
+    """
+
+    MAX_PENDING = 1000
+
+    def __init__(self):
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        self._loop = asyncio.get_event_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.MAX_PENDING)
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+    def publish(self, job_id: str, event: Dict[str, Any]):
+        if job_id in self._subscribers and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._deliver, job_id, event)
+
+    def _deliver(self, job_id: str, event: Dict[str, Any]):
+        for queue in self._subscribers.get(job_id, []):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # Slow client; it still gets the final status from the store
+
+
+job_events = JobEventBus()
+
+
+# Job store writes can wait on SQLite's write lock held by another worker, so
+# they run on the executor rather than stalling the event loop
+async def update_job(job_id: str, **fields):
+    """Update a job and push the change (minus results) to subscribers"""
+    await run_blocking(functools.partial(job_store.update, job_id, **fields))
+    job_events.publish(job_id, {"type": "status", **{k: v for k, v in fields.items() if k != "results"}})
+
+
+async def record_progress(job_id: str, result: Optional[Dict[str, Any]] = None):
+    """Count a finished screenshot and push it to subscribers"""
+    counters = await run_blocking(job_store.add_progress, job_id, result)
+    job_events.publish(job_id, {"type": "progress", "result": result, **(counters or {})})
+
+
+def with_start_hook(fn, on_start):
+    """Wrap the coroutine function fn so on_start() is awaited before its first call.
+
+    Jobs use it to switch from queued to processing once their first item
+    gets a scheduler slot, so a job waiting behind others isn't failed as stale.
+    """
+    started = False
+
+    async def wrapper(*args):
+        nonlocal started
+        if not started:
+            started = True
+            await on_start()
+        return await fn(*args)
+
+    return wrapper
+
+# Requests submitted to the fal.ai queue and not yet finished, across the process
+FAL_MAX_IN_FLIGHT = int(os.getenv("FAL_MAX_IN_FLIGHT", "100"))
+FAL_POLL_INTERVAL = float(os.getenv("FAL_POLL_INTERVAL", "1.0"))
+
+# Generation work is admitted through the scheduler: at most
+# SCHEDULER_MAX_CONCURRENT items run at once, at most SCHEDULER_PER_JOB_LIMIT of
+# them for one job, and new work is refused once SCHEDULER_MAX_QUEUE items wait.
+SCHEDULER_MAX_CONCURRENT = int(os.getenv("SCHEDULER_MAX_CONCURRENT", str(FAL_MAX_IN_FLIGHT)))
+SCHEDULER_PER_JOB_LIMIT = int(os.getenv("SCHEDULER_PER_JOB_LIMIT", "20"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "500"))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+PRIORITY_BACKGROUND = 2
+
+# Thread pool for the blocking steps around a generation (hashing, uploads,
+# downloads, local renders). Waiting on fal.ai doesn't hold a thread.
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS)
+
+
+# Blocking calls submitted through run_blocking and not finished yet (queued or running)
+executor_pending = 0
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call on the executor"""
+    global executor_pending
+    executor_pending += 1
+    try:
+        return await asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+    finally:
+        executor_pending -= 1
+
+
+# Timing spans. Each screenshot binds a dict to current_spans; stage() adds the
+# time spent in every stage (upload, submit, queue_wait, inference, download,
+# write, render, derive) to it and to the stage histogram served on /metrics.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Histogram:
+    """Cumulative Prometheus histogram with one series per value of a single label"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        # label value -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            series = self._series.setdefault(label_value, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_value, values in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {values[len(self.buckets)]}')
+            lines.append(f"{self.name}_sum{{{label}}} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{label}}} {values[len(self.buckets)]}")
+        return lines
+
+
+stage_seconds = Histogram("preview_generator_stage_seconds", "Time spent in each generation stage", "stage")
+screenshot_seconds = Histogram("preview_generator_screenshot_seconds", "Time to produce one screenshot's previews", "render_mode")
+current_spans: contextvars.ContextVar = contextvars.ContextVar("current_spans", default=None)
+
+
+def record_stage(name: str, seconds: float):
+    stage_seconds.observe(name, seconds)
+    spans = current_spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time the enclosed block as one stage of the current screenshot"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def span_timings(spans: Dict[str, float], total: float) -> Dict[str, float]:
+    """Rounded per-stage seconds for a job result"""
+    return {**{name: round(seconds, 3) for name, seconds in spans.items()}, "total": round(total, 3)}
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobScheduler:
+    """Fair, priority-aware admission of generation work.
+
+    Waiting work is grouped per priority and per job. Slots go to the
+    highest priority first and round-robin between jobs of the same priority,
+    so one large job can't starve the others.
+    """
+
+    def __init__(self, max_concurrent: int, per_job_limit: int, max_queue_depth: int):
+        self.max_concurrent = max_concurrent
+        self.per_job_limit = per_job_limit
+        self.max_queue_depth = max_queue_depth
+        self.active = 0
+        self.depth = 0
+        # priority -> job_id -> waiting grant futures, in round-robin order
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {}
+        self._running: Dict[str, int] = {}
+
+    def check_capacity(self, count: int):
+        """Raise QueueFullError if count more items would overflow the queue"""
+        if self.depth + count > self.max_queue_depth:
+            raise QueueFullError(f"Generation queue is full ({self.depth} waiting), try again later")
+
+    async def run(self, job_id: str, fn, *args, priority: int = PRIORITY_BATCH):
+        """Wait for a slot, then await the coroutine function fn(*args)"""
+        loop = asyncio.get_event_loop()
+        grant = loop.create_future()
+        self._queues.setdefault(priority, OrderedDict()).setdefault(job_id, deque()).append(grant)
+        self.depth += 1
+        self._dispatch()
+        try:
+            await grant
+        except asyncio.CancelledError:
+            # Cancelled after the slot was granted: hand it back
+            if grant.done() and not grant.cancelled():
+                self._release(job_id)
+            raise
+        try:
+            return await fn(*args)
+        finally:
+            self._release(job_id)
+
+    def _next(self):
+        for priority in sorted(self._queues):
+            jobs = self._queues[priority]
+            for job_id in list(jobs):
+                if self._running.get(job_id, 0) >= self.per_job_limit:
+                    continue
+                waiters = jobs.pop(job_id)
+                grant = waiters.popleft()
+                if waiters:
+                    jobs[job_id] = waiters  # back of the line
+                self.depth -= 1
+                if grant.cancelled():
+                    return self._next()
+                return job_id, grant
+        return None, None
+
+    def _dispatch(self):
+        while self.active < self.max_concurrent:
+            job_id, grant = self._next()
+            if grant is None:
+                return
+            self.active += 1
+            self._running[job_id] = self._running.get(job_id, 0) + 1
+            grant.set_result(None)
+
+    def _release(self, job_id: str):
+        self.active -= 1
+        self._running[job_id] -= 1
+        if not self._running[job_id]:
+            del self._running[job_id]
+        self._dispatch()
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """Items that start before this job's next waiting item, or None if it has none"""
+        ahead = 0
+        for priority in sorted(self._queues):
+            jobs = self._queues[priority]
+            if job_id in jobs:
+                # Every job ahead in the rotation gets one item first
+                return ahead + list(jobs).index(job_id)
+            ahead += sum(len(waiters) for waiters in jobs.values())
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.active,
+            "queued": self.depth,
+            "max_concurrent": self.max_concurrent,
+            "per_job_limit": self.per_job_limit,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+scheduler = JobScheduler(SCHEDULER_MAX_CONCURRENT, SCHEDULER_PER_JOB_LIMIT, SCHEDULER_MAX_QUEUE)
+
+
+def admit(count: int = 1):
+    """Reject with 429 when the scheduler can't take count more items"""
+    try:
+        scheduler.check_capacity(count)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+
+def sharded_path(base_dir: Path, key: str, filename: str) -> Path:
+    """base_dir/ab/cd/filename, with ab/cd taken from a hash of key.
+
+    Keeps any one directory small as uploads and outputs pile up.
+    """
+    digest = hashlib.md5(key.encode()).hexdigest()
+    return base_dir / digest[:2] / digest[2:4] / filename
+
+
+def output_file(preview_id: str, suffix: str = ".png") -> Path:
+    """Where a new output is written"""
+    path = sharded_path(OUTPUT_DIR, preview_id, f"{preview_id}{suffix}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def find_output(preview_id: str) -> Optional[Path]:
+    """Locate a generated preview, including ones from before sharding"""
+    for path in (sharded_path(OUTPUT_DIR, preview_id, f"{preview_id}.png"), OUTPUT_DIR / f"{preview_id}.png"):
+        if path.exists():
+            return path
+    return None
+
+
+class UploadIndex:
+    """Upload metadata in SQLite: id -> path, hash, dimensions and mime type.
+
+    upload_id includes the "bg_" prefix for backgrounds; path is relative to
+    UPLOAD_DIR.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                upload_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                mime TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS uploads_sha256 ON uploads (sha256, kind)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def get(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM uploads WHERE upload_id = ?", (upload_id,)).fetchone()
+        return dict(row) if row else None
+
+    def find_hash(self, kind: str, sha: str) -> Optional[Dict[str, Any]]:
+        """Most recent upload of kind with these contents that is still on disk"""
+        rows = self._conn().execute(
+            "SELECT * FROM uploads WHERE sha256 = ? AND kind = ? ORDER BY created_at DESC", (sha, kind)
+        ).fetchall()
+        for row in rows:
+            if (UPLOAD_DIR / row["path"]).exists():
+                return dict(row)
+        return None
+
+    def put(self, record: Dict[str, Any]):
+        columns = ("upload_id", "kind", "path", "sha256", "width", "height", "mime", "size", "created_at")
+        self._conn().execute(
+            f"INSERT OR REPLACE INTO uploads ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            tuple(record[c] for c in columns),
+        )
+
+
+upload_index = UploadIndex(USER_DATA_DIR / "uploads.db")
+
+UPLOAD_EXTENSIONS = [".png", ".jpg", ".jpeg", ".webp"]
+
+
+def upload_kind(prefix: str) -> str:
+    return "background" if prefix == "bg_" else "screenshot"
+
+
+def index_legacy_upload(upload_id: str, path: Path) -> Dict[str, Any]:
+    """Add an upload stored before the index existed"""
+    with Image.open(path) as img:
+        width, height, mime = img.width, img.height, Image.MIME.get(img.format, "application/octet-stream")
+    stat = path.stat()
+    record = {
+        "upload_id": upload_id,
+        "kind": "background" if upload_id.startswith("bg_") else "screenshot",
+        "path": str(path.relative_to(UPLOAD_DIR)),
+        "sha256": file_sha256(path),
+        "width": width,
+        "height": height,
+        "mime": mime,
+        "size": stat.st_size,
+        "created_at": stat.st_mtime,
+    }
+    upload_index.put(record)
+    return record
+
+
+def find_upload(file_id: Optional[str], prefix: str = "") -> Optional[Path]:
+    """Locate an uploaded file by ID (prefix "bg_" for backgrounds)"""
+    if not file_id:
+        return None
+    upload_id = f"{prefix}{file_id}"
+    record = upload_index.get(upload_id)
+    if record:
+        path = UPLOAD_DIR / record["path"]
+        return path if path.exists() else None
+
+    # Uploads from before the index live flat in UPLOAD_DIR: probe once, then index them
+    for ext in UPLOAD_EXTENSIONS:
+        path = UPLOAD_DIR / f"{upload_id}{ext}"
+        if path.exists():
+            try:
+                index_legacy_upload(upload_id, path)
+            except OSError as e:
+                print(f"⚠️  Could not index legacy upload {path.name}: {e}")
+            return path
+    return None
+
+
+# Upload ingestion: uploads are decoded and validated, and a normalized,
+# size-capped variant is written next to the original for FLUX to use
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "25")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_NORMALIZED_FORMAT = os.getenv("UPLOAD_NORMALIZED_FORMAT", "webp").lower()
+# Decoded format -> stored extension
+UPLOAD_FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+def normalized_path(path: Path) -> Path:
+    return path.with_name(f"{path.stem}_normalized.{UPLOAD_NORMALIZED_FORMAT}")
+
+
+def normalized_upload(path: Path) -> Path:
+    """The normalized variant of an upload if there is one, else the file itself"""
+    variant = normalized_path(Path(path))
+    return variant if variant.exists() else Path(path)
+
+
+def normalized_size(size: tuple, target: tuple, cover: bool) -> tuple:
+    """Largest size needed to fit (or, for backgrounds, cover) target, never upscaling"""
+    fit = max if cover else min
+    scale = min(1.0, fit(target[0] / size[0], target[1] / size[1]))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def finalize_upload(tmp_path: Path, sha: str, prefix: str, output_size: str, filename: str) -> Dict[str, Any]:
+    """Validate a streamed upload, store it and write its normalized variant.
+
+    Raises ValueError if the bytes aren't a supported image. Identical
+    uploads resolve to the already stored file.
+    """
+    kind = upload_kind(prefix)
+    existing = upload_index.find_hash(kind, sha)
+    if existing:
+        return upload_response(existing, filename, duplicate=True)
+
+    try:
+        with Image.open(tmp_path) as img:
+            img.verify()
+        with Image.open(tmp_path) as img:
+            if img.format not in UPLOAD_FORMATS:
+                raise ValueError(f"Unsupported image format: {img.format}")
+            extension = UPLOAD_FORMATS[img.format]
+            mime = Image.MIME[img.format]
+            image = ImageOps.exif_transpose(img)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise ValueError("Not a valid PNG, JPEG or WebP image") from e
+
+    upload_id = f"{prefix}{uuid.uuid4()}"
+    file_path = sharded_path(UPLOAD_DIR, upload_id, f"{upload_id}{extension}")
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Screenshots are fitted inside the output canvas, backgrounds cover it
+    has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+    variant = image.convert("RGBA" if has_alpha else "RGB")
+    target = normalized_size(variant.size, get_output_size(output_size), cover=prefix == "bg_")
+    if target != variant.size:
+        variant = variant.resize(target, Image.LANCZOS)
+    if UPLOAD_NORMALIZED_FORMAT == "png":
+        variant.save(normalized_path(file_path), "PNG", optimize=True)
+    else:
+        variant.save(normalized_path(file_path), "WEBP", quality=90, method=4)
+
+    os.replace(tmp_path, file_path)
+
+    record = {
+        "upload_id": upload_id,
+        "kind": kind,
+        "path": str(file_path.relative_to(UPLOAD_DIR)),
+        "sha256": sha,
+        "width": image.width,
+        "height": image.height,
+        "mime": mime,
+        "size": file_path.stat().st_size,
+        "created_at": time.time(),
+    }
+    upload_index.put(record)
+    return upload_response(record, filename, duplicate=False)
+
+
+def upload_response(record: Dict[str, Any], filename: str, duplicate: bool) -> Dict[str, Any]:
+    """Upload fields returned to the client"""
+    prefix = "bg_" if record["kind"] == "background" else ""
+    return {
+        "id": record["upload_id"][len(prefix):],
+        "filename": filename,
+        "path": Path(record["path"]).name,
+        "size": record["size"],
+        "width": record["width"],
+        "height": record["height"],
+        "mime": record["mime"],
+        "duplicate": duplicate,
+    }
+
+
+async def ingest_upload(file: UploadFile, prefix: str = "", output_size: str = "app-store") -> Dict[str, Any]:
+    """Stream an upload to disk off the event loop, then validate and store it"""
+    tmp_path = UPLOAD_DIR / f".{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if received > UPLOAD_MAX_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{file.filename} is larger than {UPLOAD_MAX_BYTES // (1024 * 1024)} MB")
+                digest.update(chunk)
+                await run_blocking(out.write, chunk)
+        try:
+            return await run_blocking(finalize_upload, tmp_path, digest.hexdigest(), prefix, output_size, file.filename)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
 
 # fal.ai API key
 FAL_KEY = os.getenv("FAL_KEY")
@@ -45,6 +845,549 @@ if not FAL_KEY:
     print("⚠️  Warning: FAL_KEY not found in .env file")
 
 
+def file_sha256(path: Path) -> str:
+    """SHA-256 of a file's contents, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """Content-addressed cache of fal.ai storage URLs.
+
+    Maps the SHA-256 of a file to the URL returned by fal_client.upload_file so
+    the same bytes are uploaded at most once per TTL window. Uploads ask fal.ai
+    to keep the file a little longer than the TTL, so a cached URL outlives its
+    entry. Entries live in SQLite and are evicted LRU-first once max_entries is
+    reached.
+    """
+
+    # Extra fal.ai retention past the TTL, covering a generation started just before expiry
+    URL_GRACE_SECONDS = 60 * 60
+
+    def __init__(self, path: Path, ttl_seconds: int, max_entries: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # (path, size, mtime_ns) -> sha256, so unchanged files aren't re-hashed
+        self._hash_memo: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                sha256 TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                uploaded_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+        return conn
+
+    def content_hash(self, path: Path) -> str:
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            sha = self._hash_memo.get(key)
+        if sha is None:
+            sha = file_sha256(path)
+            with self._lock:
+                if len(self._hash_memo) >= 10000:
+                    self._hash_memo.clear()
+                self._hash_memo[key] = sha
+        return sha
+
+    def get(self, sha: str) -> Optional[str]:
+        conn = self._conn()
+        row = conn.execute("SELECT url, uploaded_at FROM uploads WHERE sha256 = ?", (sha,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] >= self.ttl_seconds:
+            conn.execute("DELETE FROM uploads WHERE sha256 = ?", (sha,))
+            return None
+        conn.execute("UPDATE uploads SET last_used = ? WHERE sha256 = ?", (now, sha))
+        return row[0]
+
+    def put(self, sha: str, url: str):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)", (sha, url, now, now))
+        conn.execute(
+            "DELETE FROM uploads WHERE sha256 IN "
+            "(SELECT sha256 FROM uploads ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def invalidate(self, sha: str):
+        self._conn().execute("DELETE FROM uploads WHERE sha256 = ?", (sha,))
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _upload(self, path: Path, sha: str) -> str:
+        lifecycle = fal_client.StorageSettings(expires_in=self.ttl_seconds + self.URL_GRACE_SECONDS)
+        url = fal_client.upload_file(str(path), lifecycle=lifecycle)
+        self.put(sha, url)
+        return url
+
+    def upload(self, path: Path) -> str:
+        """Return a fal.ai URL for path, uploading only on a cache miss"""
+        path = Path(path)
+        sha = self.content_hash(path)
+        url = self.get(sha)
+        self._count(url is not None)
+        return url if url is not None else self._upload(path, sha)
+
+    async def upload_async(self, path: Path, refresh: bool = False) -> tuple:
+        """(url, cached) for path, off the event loop.
+
+        Concurrent misses for the same bytes share one upload. refresh drops
+        the cached URL first, for when fal.ai could no longer fetch it.
+        """
+        path = Path(path)
+        sha = await run_blocking(self.content_hash, path)
+        if refresh:
+            await run_blocking(self.invalidate, sha)
+        url = await run_blocking(self.get, sha)
+        self._count(url is not None)
+        if url is not None:
+            return url, True
+        return await upload_flight.run(sha, run_blocking, self._upload, path, sha), False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "entries": self._conn().execute("SELECT COUNT(*) FROM uploads").fetchone()[0],
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else 0.0,
+        }
+
+
+# fal.ai storage URLs are only valid for a limited time, so cached entries expire
+upload_cache = UploadCache(
+    USER_DATA_DIR / "upload_cache.db",
+    ttl_seconds=int(os.getenv("FAL_UPLOAD_TTL_SECONDS", str(24 * 60 * 60))),
+    max_entries=int(os.getenv("FAL_UPLOAD_CACHE_MAX_ENTRIES", "5000")),
+)
+
+
+def link_or_copy(src_path: Path, dst_path: Path):
+    """Put src_path's bytes at dst_path atomically, as a hard link where the filesystem allows"""
+    dst_path = Path(dst_path)
+    tmp_path = dst_path.with_name(f".{dst_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.link(src_path, tmp_path)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def touch_atime(path: Path) -> os.stat_result:
+    """Mark path as used now without changing its mtime"""
+    stat = path.stat()
+    os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+    return stat
+
+
+class DiskCache:
+    """Size-bounded LRU cache of files in a directory, keyed by a hex string.
+
+    Recency is tracked through file access times, so the LRU order is rebuilt
+    from the directory listing on startup without a separate index. mtimes
+    are left alone, since entries can be hard links to generated previews.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int, suffix: str = ".png"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = [(p.stat(), p) for p in self.cache_dir.glob(f"*{suffix}")]
+        for stat, path in sorted(files, key=lambda item: item[0].st_atime):
+            self._entries[path.name[:-len(suffix)]] = stat.st_size
+            self.total_bytes += stat.st_size
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}{self.suffix}"
+
+    def get(self, key: str) -> Optional[Path]:
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self.path_for(key)
+            try:
+                touch_atime(path)
+            except FileNotFoundError:
+                self.total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return path
+
+    def copy_to(self, key: str, dst_path: Path) -> bool:
+        """Place the entry for key at dst_path; False on a miss.
+
+        An entry evicted between the lookup and the copy counts as a miss.
+        """
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dst_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+                if key in self._entries:
+                    self.total_bytes -= self._entries.pop(key)
+            return False
+        return True
+
+    def put(self, key: str, src_path: Path) -> Path:
+        """Link (or copy) src_path into the cache and evict least recently used entries"""
+        path = self.path_for(key)
+        link_or_copy(src_path, path)
+        size = touch_atime(path).st_size
+        with self._lock:
+            self.total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self.path_for(old_key).unlink(missing_ok=True)
+                self.total_bytes -= old_size
+        return path
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+# Generated images keyed by the fingerprint of the FLUX request that produced them
+result_cache = DiskCache(
+    OUTPUT_DIR / "cache",
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+)
+
+
+# Shared HTTP session for downloading generated images
+DOWNLOAD_TIMEOUT = (
+    float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10")),
+    float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60")),
+)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+def create_http_session() -> requests.Session:
+    """Pooled session that retries connection errors and 429/5xx with backoff"""
+    retry = Retry(
+        total=int(os.getenv("DOWNLOAD_RETRIES", "3")),
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BLOCKING_WORKERS, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+def download_file(url: str, output_path: Path, session: Optional[requests.Session] = None):
+    """Stream url to output_path via a temp file renamed into place"""
+    session = session or http_session
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.part")
+    try:
+        with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class FalQueuePoller:
+    """Submit fal.ai requests to the queue and track them all from one task.
+
+    run() submits a request and waits on a future; a single background task
+    polls the status of every pending request each FAL_POLL_INTERVAL and
+    fetches results as they complete. At most max_in_flight requests are
+    submitted at once.
+    """
+
+    MAX_STATUS_ERRORS = 5
+
+    def __init__(self, max_in_flight: int, poll_interval: float):
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self._slots: Optional[asyncio.Semaphore] = None
+        # request_id -> {"application", "handle", "future", "errors", "fetching", "started_at"}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def run(self, application: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Submit to the queue and wait for the result.
+
+        Records the submit, queue_wait (waiting for a slot plus the fal queue)
+        and inference stages; the split between the last two is only as
+        precise as the poll interval.
+        """
+        entered = time.perf_counter()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        async with self._slots:
+            slot_wait = time.perf_counter() - entered
+            with stage("submit"):
+                handle = await fal_client.submit_async(application, arguments=arguments)
+            submitted_at = time.perf_counter()
+            self.submitted += 1
+            future = asyncio.get_event_loop().create_future()
+            entry = self._pending[handle.request_id] = {
+                "application": application,
+                "handle": handle,
+                "future": future,
+                "errors": 0,
+                "fetching": False,
+                "started_at": None,
+            }
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._poll())
+            try:
+                return await future
+            except asyncio.CancelledError:
+                try:
+                    await handle.cancel()
+                except Exception:
+                    pass
+                raise
+            finally:
+                self._pending.pop(handle.request_id, None)
+                finished_at = time.perf_counter()
+                started_at = entry["started_at"] or finished_at
+                record_stage("queue_wait", slot_wait + started_at - submitted_at)
+                record_stage("inference", finished_at - started_at)
+
+    async def _poll(self):
+        while self._pending:
+            await asyncio.sleep(self.poll_interval)
+            entries = [e for e in self._pending.values() if not e["fetching"] and not e["future"].done()]
+            statuses = await asyncio.gather(
+                *(e["handle"].status() for e in entries), return_exceptions=True
+            )
+            for entry, status in zip(entries, statuses):
+                if isinstance(status, Exception):
+                    entry["errors"] += 1
+                    if entry["errors"] >= self.MAX_STATUS_ERRORS:
+                        self._finish(entry, error=status)
+                    continue
+                entry["errors"] = 0
+                if entry["started_at"] is None and isinstance(status, (fal_client.InProgress, fal_client.Completed)):
+                    entry["started_at"] = time.perf_counter()
+                if isinstance(status, fal_client.Completed):
+                    entry["fetching"] = True
+                    asyncio.create_task(self._fetch(entry))
+
+    async def _fetch(self, entry: Dict[str, Any]):
+        try:
+            result = await fal_client.result_async(entry["application"], entry["handle"].request_id)
+        except Exception as e:
+            self._finish(entry, error=e)
+        else:
+            self._finish(entry, result=result)
+
+    def _finish(self, entry: Dict[str, Any], result: Any = None, error: Optional[Exception] = None):
+        future = entry["future"]
+        if future.done():
+            return
+        if error is not None:
+            self.failed += 1
+            future.set_exception(error)
+        else:
+            self.completed += 1
+            future.set_result(result)
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "poll_interval": self.poll_interval,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+fal_poller = FalQueuePoller(FAL_MAX_IN_FLIGHT, FAL_POLL_INTERVAL)
+
+
+def generation_fingerprint(model: str, arguments: Dict[str, Any], image_files: List[Path]) -> str:
+    """Canonical hash of everything that determines a FLUX output"""
+    payload = {
+        "model": model,
+        "arguments": {k: v for k, v in arguments.items() if k != "image_urls"},
+        "images": [upload_cache.content_hash(Path(p)) for p in image_files],
+    }
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def content_seed(*hashes: str) -> int:
+    """Deterministic FLUX seed from content hashes"""
+    return int(hashlib.sha256(":".join(hashes).encode()).hexdigest()[:8], 16)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one.
+
+    The first caller starts the work as its own task; callers arriving before
+    it finishes await the same task and get the same result or exception.
+    The task is shielded, so one caller going away doesn't cancel it for the
+    rest. Only coalesces within this process.
+    """
+
+    def __init__(self, wait_stage: str = "coalesced_wait"):
+        self.wait_stage = wait_stage
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, fn, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None) if self._inflight.get(key) is task else None)
+            self.calls += 1
+            return await asyncio.shield(task)
+        self.coalesced += 1
+        with stage(self.wait_stage):
+            return await asyncio.shield(task)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+
+# Identical FLUX generations (same fingerprint) running at the same time share one call
+generation_flight = SingleFlight()
+# Concurrent uploads of the same bytes share one fal.ai upload
+upload_flight = SingleFlight("upload_wait")
+
+
+async def generate_flux_output(model: str, arguments: Dict[str, Any], image_files: List[Path], output_path: Path, fingerprint: Optional[str]) -> Optional[Path]:
+    """Upload inputs, run FLUX and download the first image; returns output_path, or None without an image"""
+    uploads = []
+    if image_files:
+        with stage("upload"):
+            uploads = [await upload_cache.upload_async(p) for p in image_files]
+        arguments = {**arguments, "image_urls": [url for url, _ in uploads]}
+
+    try:
+        result = await fal_poller.run(model, arguments)
+    except Exception as e:
+        # A cached URL fal.ai can no longer fetch fails the request; re-upload those inputs once
+        if not any(cached for _, cached in uploads):
+            raise
+        print(f"⚠️  FLUX failed with cached upload URLs, re-uploading and retrying: {e}")
+        with stage("upload"):
+            uploads = [await upload_cache.upload_async(p, refresh=cached) for p, (_, cached) in zip(image_files, uploads)]
+        arguments = {**arguments, "image_urls": [url for url, _ in uploads]}
+        result = await fal_poller.run(model, arguments)
+    if not (result and "images" in result and len(result["images"]) > 0):
+        return None
+
+    with stage("download"):
+        await run_blocking(download_file, result["images"][0]["url"], output_path)
+
+    if fingerprint:
+        with stage("write"):
+            await run_blocking(result_cache.put, fingerprint, output_path)
+    return Path(output_path)
+
+
+async def run_flux(model: str, arguments: Dict[str, Any], image_files: List[Path], output_path: Path, use_cache: bool = True) -> bool:
+    """Run a fal.ai FLUX model and save the first image to output_path.
+
+    image_files are uploaded and passed as image_urls. Requests with a
+    deterministic seed are served from result_cache when the same fingerprint
+    was generated before, and share one call with an identical request still
+    in flight. Returns False if FLUX produced no image.
+    """
+    fingerprint = await run_blocking(generation_fingerprint, model, arguments, image_files) if use_cache else None
+    if not fingerprint:
+        return await generate_flux_output(model, arguments, image_files, output_path, None) is not None
+
+    started = time.perf_counter()
+    if await run_blocking(result_cache.copy_to, fingerprint, output_path):
+        record_stage("write", time.perf_counter() - started)
+        print(f"♻️  Result cache hit: {fingerprint[:12]}")
+        return True
+
+    generated_path = await generation_flight.run(
+        fingerprint, generate_flux_output, model, arguments, image_files, output_path, fingerprint
+    )
+    if generated_path is None:
+        return False
+    # Waiters that asked for a different file get a copy of the one generated
+    if generated_path != Path(output_path):
+        with stage("write"):
+            await run_blocking(link_or_copy, generated_path, output_path)
+        print(f"🔗 Coalesced with in-flight generation: {fingerprint[:12]}")
+    return True
+
+
 class Screenshot(BaseModel):
     id: str
     textOverlay: Optional[Dict[str, Any]] = None
@@ -63,6 +1406,10 @@ class GenerationRequest(BaseModel):
         "reflection": False
     }
     output_size: str = "app-store"
+    output_sizes: Optional[List[str]] = None  # Several presets from one generation per screenshot
+    captions: Optional[Dict[str, List[str]]] = None  # Locale -> caption per screenshot, over one text-free render
+    render_mode: str = "flux"  # "flux", "local" or "local+flux-polish"
+    seed: Optional[int] = None  # FLUX seed of the first screenshot, +1 per screenshot; derived from content when unset
 
 
 @app.get("/")
@@ -75,7 +1422,7 @@ async def root():
 
 
 @app.post("/api/upload")
-async def upload_screenshots(files: List[UploadFile] = File(...)):
+async def upload_screenshots(files: List[UploadFile] = File(...), output_size: str = Form("app-store")):
     """Upload screenshots"""
     uploaded_files = []
 
@@ -83,44 +1430,42 @@ async def upload_screenshots(files: List[UploadFile] = File(...)):
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail=f"{file.filename} is not an image")
 
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix
-        file_path = UPLOAD_DIR / f"{file_id}{file_extension}"
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload = await ingest_upload(file, output_size=output_size)
 
         uploaded_files.append({
-            "id": file_id,
+            "id": upload["id"],
             "filename": file.filename,
-            "path": f"{file_id}{file_extension}",  # Just the filename, relative resolution will handle it
-            "size": file_path.stat().st_size
+            "path": upload["path"],  # Just the filename, relative resolution will handle it
+            "size": upload["size"],
+            "width": upload["width"],
+            "height": upload["height"],
+            "duplicate": upload["duplicate"]
         })
 
     return {"success": True, "files": uploaded_files, "count": len(uploaded_files)}
 
 
 @app.post("/api/upload-background")
-async def upload_background(file: UploadFile = File(...)):
+async def upload_background(file: UploadFile = File(...), output_size: str = Form("app-store")):
     """Upload background image"""
     try:
         if not file.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail=f"{file.filename} is not an image")
 
-        file_id = str(uuid.uuid4())
-        file_extension = Path(file.filename).suffix
-        file_path = UPLOAD_DIR / f"bg_{file_id}{file_extension}"
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        upload = await ingest_upload(file, prefix="bg_", output_size=output_size)
 
         return {
             "success": True,
-            "file_id": file_id,
+            "file_id": upload["id"],
             "filename": file.filename,
-            "path": str(file_path),
-            "size": file_path.stat().st_size
+            "path": str(await run_blocking(find_upload, upload["id"], "bg_")),
+            "size": upload["size"],
+            "width": upload["width"],
+            "height": upload["height"],
+            "duplicate": upload["duplicate"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -128,18 +1473,21 @@ async def upload_background(file: UploadFile = File(...)):
 @app.post("/api/generate")
 async def generate_previews(request: GenerationRequest, background_tasks: BackgroundTasks):
     """Generate previews using FLUX"""
-    job_id = str(uuid.uuid4())
+    if request.render_mode not in RENDER_MODES:
+        raise HTTPException(status_code=400, detail=f"render_mode must be one of {', '.join(RENDER_MODES)}")
+    unknown_sizes = [size for size in request.output_sizes or [] if size not in OUTPUT_SIZES]
+    if unknown_sizes:
+        raise HTTPException(status_code=400, detail=f"Unknown output sizes: {', '.join(unknown_sizes)}")
+    for locale, captions in (request.captions or {}).items():
+        if not LOCALE_PATTERN.match(locale):
+            raise HTTPException(status_code=400, detail=f"Invalid locale: {locale}")
+        if len(captions) != len(request.screenshots):
+            raise HTTPException(status_code=400, detail=f"{locale} needs one caption per screenshot")
+
+    admit(len(request.screenshots))
 
-    jobs_db[job_id] = {
-        "job_id": job_id,
-        "status": "queued",
-        "progress": 0,
-        "total_screenshots": len(request.screenshots),
-        "completed_screenshots": 0,
-        "results": [],
-        "created_at": datetime.now().isoformat(),
-        "error": None
-    }
+    job_id = str(uuid.uuid4())
+    await run_blocking(job_store.create, new_job(job_id, len(request.screenshots)))
 
     background_tasks.add_task(process_job, job_id, request)
 
@@ -153,257 +1501,830 @@ async def generate_previews(request: GenerationRequest, background_tasks: Backgr
 @app.get("/api/status/{job_id}")
 async def get_job_status(job_id: str):
     """Get job status"""
-    if job_id not in jobs_db:
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return jobs_db[job_id]
+    # Only known to the worker running the job
+    job["queue_position"] = scheduler.queue_position(job_id)
+    return job
+
+
+# Subscribers re-read the job store at this interval, so jobs running in
+# another worker process still report progress and completion
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_SECONDS", "5"))
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Stream job progress as server-sent events.
+
+    Starts with a "snapshot" of the job, then sends "progress" per finished
+    screenshot, "screenshot_failed" per error and "status" changes until the
+    job completes or fails.
+    """
+    queue = job_events.subscribe(job_id)
+    job = job_store.get(job_id)
+    if job is None:
+        job_events.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        last = job
+        try:
+            yield sse_event("snapshot", last)
+            if last["status"] in JOB_FINISHED_STATUSES:
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=JOB_EVENTS_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    current = job_store.get(job_id)
+                    if current is None:
+                        return
+                    if current["completed_screenshots"] != last["completed_screenshots"]:
+                        yield sse_event("progress", {
+                            "completed_screenshots": current["completed_screenshots"],
+                            "progress": current["progress"],
+                        })
+                    if current["status"] != last["status"]:
+                        yield sse_event("status", {"status": current["status"], "error": current.get("error")})
+                    if current["status"] in JOB_FINISHED_STATUSES:
+                        return
+                    last = current
+                    yield ": keep-alive\n\n"
+                    continue
+
+                # Events are shared between subscribers, so copy rather than mutate
+                data = {k: v for k, v in event.items() if k != "type"}
+                last = {**last, **{k: v for k, v in data.items() if k in ("status", "completed_screenshots", "progress")}}
+                yield sse_event(event["type"], data)
+                if data.get("status") in JOB_FINISHED_STATUSES:
+                    return
+        finally:
+            job_events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/api/download/{preview_id}")
 async def download_preview(preview_id: str):
     """Download generated preview"""
-    file_path = OUTPUT_DIR / f"{preview_id}.png"
-    if not file_path.exists():
+    file_path = find_output(preview_id)
+    if not file_path:
         raise HTTPException(status_code=404, detail="Preview not found")
     return FileResponse(file_path, media_type="image/png", filename=f"preview_{preview_id}.png")
 
 
-@app.post("/api/edit-preview/{preview_id}")
-async def edit_preview(preview_id: str, text_overlay: Dict[str, Any]):
-    """Re-edit a generated preview with new caption"""
+# Resized derivatives of generated previews for gallery views
+PREVIEW_WIDTHS = (160, 320, 480, 640, 960, 1290)
+PREVIEW_FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 82, "method": 4}),
+    "avif": ("AVIF", "image/avif", {"quality": 60}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 85, "optimize": True, "progressive": True}),
+}
+Image.init()
+PREVIEW_FORMATS = {name: spec for name, spec in PREVIEW_FORMATS.items() if spec[0] in Image.SAVE}
+
+preview_cache = DiskCache(
+    OUTPUT_DIR / "derivatives",
+    max_bytes=int(os.getenv("PREVIEW_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    suffix=".img",
+)
+
+
+def build_derivative(source: Path, width: int, image_format: str, key: str) -> Path:
+    """Resize source to width (never upscaling), encode it and add it to preview_cache"""
+    pil_format, _, options = PREVIEW_FORMATS[image_format]
+    tmp_path = preview_cache.cache_dir / f".{uuid.uuid4().hex}.tmp"
     try:
-        # Find the generated preview file
-        preview_path = OUTPUT_DIR / f"{preview_id}.png"
-        if not preview_path.exists():
-            raise HTTPException(status_code=404, detail="Preview not found")
-
-        # Upload preview to fal.ai
-        image_url = fal_client.upload_file(str(preview_path))
-
-        # Build prompt with just the text overlay changes
-        prompt_parts = []
-        if text_overlay and text_overlay.get("text"):
-            text = text_overlay["text"]
-            position = text_overlay.get("position", "top")
-            prompt_parts.append(f'text overlay "{text}" positioned at the {position}')
-            prompt_parts.append("professional, clean, modern app store aesthetic, high quality")
-            prompt = ", ".join(prompt_parts)
-        else:
-            raise HTTPException(status_code=400, detail="No text overlay provided")
+        with Image.open(source) as img:
+            img.thumbnail((width, img.height), Image.LANCZOS, reducing_gap=3.0)
+            if pil_format == "JPEG" and img.mode != "RGB":
+                img = img.convert("RGB")
+            img.save(tmp_path, pil_format, **options)
+        return preview_cache.put(key, tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+@app.get("/api/preview/{preview_id}")
+async def get_preview(preview_id: str, request: Request, w: int = 480, image_format: str = Query("webp", alias="format")):
+    """Resized preview for thumbnails and galleries.
+
+    w is rounded up to the next of PREVIEW_WIDTHS. URLs are cached as
+    immutable, so clients add a version parameter when a preview is re-edited.
+    """
+    image_format = image_format.lower()
+    if image_format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(PREVIEW_FORMATS)}")
+    if not 1 <= w <= 4096:
+        raise HTTPException(status_code=400, detail="w must be between 1 and 4096")
+
+    source = find_output(preview_id)
+    if not source:
+        raise HTTPException(status_code=404, detail="Preview not found")
 
-        # Get output size (use app-store default)
-        size = (1290, 2796)
+    width = next((size for size in PREVIEW_WIDTHS if size >= w), PREVIEW_WIDTHS[-1])
+    stat = source.stat()
+    key = hashlib.sha256(f"{preview_id}:{stat.st_mtime_ns}:{stat.st_size}:{width}:{image_format}".encode()).hexdigest()
+    etag = f'"{key[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    path = preview_cache.get(key)
+    if not path:
+        path = await run_blocking(build_derivative, source, width, image_format, key)
+    return FileResponse(path, media_type=PREVIEW_FORMATS[image_format][1], headers=headers)
+
+
+# Streamed ZIP export of generated previews
+EXPORT_CHUNK_SIZE = 256 * 1024
+# Output size preset -> device folder used by the store naming layout
+STORE_DEVICE_NAMES = {
+    "app-store": "iphone-6.7in",
+    "play-store": "phone",
+    "ipad": "ipad-12.9in",
+}
 
-        print(f"🎨 Re-editing preview with prompt: {prompt}")
 
-        # Generate seed for consistency
-        seed = int(preview_id.replace("-", "")[:8], 16) % (2**32)
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable sink that zipfile writes into and the response drains"""
 
-        # Call FLUX edit-image API
-        result = fal_client.subscribe(
-            "fal-ai/flux-2/edit",
-            arguments={
-                "prompt": prompt,
-                "image_urls": [image_url],
-                "strength": 0.65,
-                "guidance_scale": 3.5,
-                "num_inference_steps": 28,
-                "seed": seed,
-                "image_size": {"width": size[0], "height": size[1]},
-                "enable_safety_checker": True,
-            },
-        )
+    def __init__(self):
+        self._buffer = bytearray()
 
-        # Download and save result (overwrite original)
-        if result and "images" in result and len(result["images"]) > 0:
-            generated_url = result["images"][0]["url"]
-            response = requests.get(generated_url)
-            with open(preview_path, "wb") as f:
-                f.write(response.content)
+    def writable(self) -> bool:
+        return True
 
-            return {
-                "success": True,
-                "preview_id": preview_id,
-                "download_url": f"/api/download/{preview_id}"
-            }
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def output_preset(size: tuple) -> Optional[str]:
+    """The get_output_size preset with exactly these dimensions, if any"""
+    for preset in OUTPUT_SIZES:
+        if get_output_size(preset) == tuple(size):
+            return preset
+    return None
+
+
+def export_files(previews: List[tuple]) -> List[tuple]:
+    """(path, folder) for every (preview_id, folder) that exists, in order.
+
+    folder groups previews such as one locale's captions, "" for the top level.
+    """
+    files = []
+    for preview_id, group in previews:
+        path = find_output(preview_id)
+        if path:
+            files.append((path, group))
+    return files
+
+
+def export_entries(files: List[tuple], naming: str):
+    """Yield (archive name, path) for each export file.
+
+    Store naming reads each image's size here, as the ZIP streams, so the
+    download starts before every file has been opened.
+    """
+    counts: Dict[str, int] = {}
+    for path, group in files:
+        if naming == "store":
+            with Image.open(path) as img:
+                size = img.size
+            preset = output_preset(size)
+            folder = f"{preset}/{STORE_DEVICE_NAMES[preset]}" if preset else "custom"
+            folder = f"{folder}_{size[0]}x{size[1]}"
         else:
-            raise Exception("No image generated by FLUX")
+            folder = ""
+        folder = "/".join(part for part in (group, folder) if part)
+        # Numbered per folder, so each device size and locale starts at 01
+        counts[folder] = counts.get(folder, 0) + 1
+        name = f"{counts[folder]:02d}.png" if naming == "store" else f"preview_{counts[folder]:02d}.png"
+        yield (f"{folder}/{name}" if folder else name, path)
+
+
+def result_previews(result: Dict[str, Any]) -> List[tuple]:
+    """(preview_id, folder) for every image a job result produced"""
+    def sized(entry: Dict[str, Any], group: str) -> List[tuple]:
+        if "sizes" in entry:
+            return [(size["preview_id"], group) for size in entry["sizes"].values()]
+        return [(entry["preview_id"], group)]
+
+    if "locales" in result:
+        return [item for locale, entry in result["locales"].items() for item in sized(entry, locale)]
+    if "preview_id" not in result:
+        return []
+    return sized(result, "")
+
+
+def iter_zip(entries: Iterable[tuple]):
+    """Yield a ZIP of entries as it is built, holding at most one chunk in memory.
+
+    PNGs are already compressed, so entries are stored rather than deflated.
+    """
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as archive:
+        for arcname, path in entries:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, archive.open(info, "w") as dest:
+                for chunk in iter(lambda: src.read(EXPORT_CHUNK_SIZE), b""):
+                    dest.write(chunk)
+                    yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()
+
+
+def zip_response(files: List[tuple], naming: str, filename: str) -> StreamingResponse:
+    if not files:
+        raise HTTPException(status_code=404, detail="Nothing to export")
+    chunks = (chunk for chunk in iter_zip(export_entries(files, naming)) if chunk)
+    return StreamingResponse(
+        chunks,
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/jobs/{job_id}/export")
+async def export_job(job_id: str, naming: str = "plain"):
+    """Download all of a job's previews as one ZIP.
+
+    naming=store groups files by store and device size, e.g.
+    app-store/iphone-6.7in_1290x2796/01.png.
+    """
+    if naming not in ("plain", "store"):
+        raise HTTPException(status_code=400, detail="naming must be plain or store")
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    previews = [item for result in job.get("results", []) for item in result_previews(result)]
+    files = await run_blocking(export_files, previews)
+    return zip_response(files, naming, f"previews_{job_id}.zip")
+
+
+@app.get("/api/queue")
+async def get_queue_stats():
+    """Get scheduler load and fal.ai requests in flight"""
+    return {**scheduler.stats(), "fal": fal_poller.stats(), "coalescing": generation_flight.stats()}
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {
+        "uploads": upload_cache.stats(),
+        "results": result_cache.stats(),
+        "previews": preview_cache.stats(),
+        "captions": caption_cache.stats(),
+        "prompts": prompt_cache_stats(),
+    }
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Get cache hit/miss counters"""
+    return cache_stats()
+
+
+def metric_lines(name: str, kind: str, help_text: str, samples: List[tuple]) -> List[str]:
+    """Prometheus text lines for one metric; samples are (labels, value) pairs"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: stage latencies, queue depths and cache counters"""
+    queue = scheduler.stats()
+    fal = fal_poller.stats()
+    flight = generation_flight.stats()
+    caches = cache_stats()
+    lines = stage_seconds.render() + screenshot_seconds.render()
+    lines += metric_lines("preview_generator_scheduler_active", "gauge", "Screenshots being generated",
+                          [({}, queue["active"])])
+    lines += metric_lines("preview_generator_scheduler_queued", "gauge", "Screenshots waiting for a scheduler slot",
+                          [({}, queue["queued"])])
+    lines += metric_lines("preview_generator_executor_workers", "gauge", "Blocking-work threads",
+                          [({}, BLOCKING_WORKERS)])
+    lines += metric_lines("preview_generator_executor_pending", "gauge", "Blocking calls running or waiting for a thread",
+                          [({}, executor_pending)])
+    lines += metric_lines("preview_generator_executor_queue_depth", "gauge", "Blocking calls waiting for a thread",
+                          [({}, max(0, executor_pending - BLOCKING_WORKERS))])
+    lines += metric_lines("preview_generator_fal_in_flight", "gauge", "fal.ai requests in flight",
+                          [({}, fal["in_flight"])])
+    lines += metric_lines("preview_generator_fal_requests_total", "counter", "fal.ai requests by outcome",
+                          [({"outcome": outcome}, fal[outcome]) for outcome in ("submitted", "completed", "failed")])
+    lines += metric_lines("preview_generator_generations_total", "counter", "FLUX generations actually run",
+                          [({}, flight["calls"])])
+    lines += metric_lines("preview_generator_generations_coalesced_total", "counter", "FLUX generations served by an identical one in flight",
+                          [({}, flight["coalesced"])])
+    lines += metric_lines("preview_generator_cache_hits_total", "counter", "Cache hits",
+                          [({"cache": cache}, stats["hits"]) for cache, stats in caches.items()])
+    lines += metric_lines("preview_generator_cache_misses_total", "counter", "Cache misses",
+                          [({"cache": cache}, stats["misses"]) for cache, stats in caches.items()])
+    lines += metric_lines("preview_generator_cache_hit_ratio", "gauge", "Cache hits over lookups",
+                          [({"cache": cache}, round(stats["hit_ratio"], 4)) for cache, stats in caches.items()])
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+async def reedit_preview(preview_id: str, text_overlay: Dict[str, Any]):
+    """Re-edit a generated preview in place with FLUX"""
+    # Find the generated preview file
+    preview_path = find_output(preview_id)
+    if not preview_path:
+        raise HTTPException(status_code=404, detail="Preview not found")
+
+    # Build prompt with just the text overlay changes
+    if text_overlay and text_overlay.get("text"):
+        prompt = compile_text_edit_prompt(text_overlay["text"], freeze(text_overlay.get("position", "top")))
+    else:
+        raise HTTPException(status_code=400, detail="No text overlay provided")
+
+    # Get output size (use app-store default)
+    size = (1290, 2796)
+
+    print(f"🎨 Re-editing preview with prompt: {prompt.text}")
+
+    # Generate seed for consistency
+    seed = int(preview_id.replace("-", "")[:8], 16) % (2**32)
+
+    # Call FLUX edit-image API and save result (overwrite original)
+    generated = await run_flux(
+        "fal-ai/flux-2/edit",
+        {
+            "prompt": prompt.text,
+            "strength": 0.65,
+            "guidance_scale": 3.5,
+            "num_inference_steps": 28,
+            "seed": seed,
+            "image_size": {"width": size[0], "height": size[1]},
+            "enable_safety_checker": True,
+        },
+        [preview_path],
+        preview_path,
+    )
+
+    if generated:
+        return {
+            "success": True,
+            "preview_id": preview_id,
+            "download_url": f"/api/download/{preview_id}"
+        }
+    else:
+        raise Exception("No image generated by FLUX")
 
+
+@app.post("/api/edit-preview/{preview_id}")
+async def edit_preview(preview_id: str, text_overlay: Dict[str, Any]):
+    """Re-edit a generated preview with new caption"""
+    admit()
+    try:
+        return await scheduler.run(
+            f"edit_{preview_id}", reedit_preview, preview_id, text_overlay, priority=PRIORITY_INTERACTIVE
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 class TemplatePreviewRequest(BaseModel):
     template_id: int
+    background: bool = False  # Return a job ID instead of waiting for all previews
+
+
+# Templates are defined in templates/templates.json. source_screenshots folders
+# are relative to the project root and listed in filename order.
+PROJECT_ROOT = Path(__file__).parent.parent
+TEMPLATES_FILE = Path(os.getenv("TEMPLATES_FILE", str(PROJECT_ROOT / "templates" / "templates.json")))
+TEMPLATE_RELOAD_SECONDS = float(os.getenv("TEMPLATE_RELOAD_SECONDS", "2"))
+TEMPLATE_PREUPLOAD = os.getenv("TEMPLATE_PREUPLOAD", "1") != "0"
+TEMPLATE_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class TemplateRegistry:
+    """Templates from templates.json plus facts about their source screenshots.
+
+    Content hashes and dimensions are computed once per file version, and with
+    a FAL_KEY every screenshot is uploaded to fal.ai in the background so
+    template generations skip the upload. The files are re-checked in the
+    background at most every reload_seconds, and the registry reloads when
+    any of them changed.
+    """
+
+    def __init__(self, path: Path, reload_seconds: float, preupload: bool):
+        self.path = path
+        self.root = path.parent.parent
+        self.reload_seconds = reload_seconds
+        self.preupload = preupload
+        self._templates: Dict[int, Dict[str, Any]] = {}
+        self._signature: Optional[tuple] = None
+        self._checked_at = 0.0
+        self._last_error: Optional[str] = None
+        # (path, size, mtime_ns) -> (width, height)
+        self._dimensions: Dict[tuple, tuple] = {}
+        self._lock = threading.Lock()
+        # Called with no arguments after a reload changed the templates, from whichever thread reloaded
+        self.listeners: List[Any] = []
+        self.reload()
+
+    def _source_files(self, template: Dict[str, Any]) -> List[Path]:
+        folder = template.get("source_screenshots")
+        if not folder:
+            return []
+        folder = self.root / folder
+        if not folder.is_dir():
+            print(f"⚠️  Template {template.get('id')}: missing screenshot folder {folder}")
+            return []
+        return sorted(p for p in folder.iterdir() if p.suffix.lower() in TEMPLATE_IMAGE_SUFFIXES)
+
+    def _signature_of(self, templates: List[Dict[str, Any]]) -> tuple:
+        stats = []
+        for path in [self.path] + [p for t in templates for p in self._source_files(t)]:
+            stat = path.stat()
+            stats.append((str(path), stat.st_size, stat.st_mtime_ns))
+        return tuple(stats)
+
+    def _screenshot(self, path: Path) -> Dict[str, Any]:
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._dimensions:
+            with Image.open(path) as image:
+                self._dimensions[key] = image.size
+        width, height = self._dimensions[key]
+        return {
+            "file": path.name,
+            "path": path,
+            "sha256": upload_cache.content_hash(path),
+            "width": width,
+            "height": height,
+        }
+
+    def reload(self) -> bool:
+        """Re-read templates.json and the screenshot folders; returns True if anything changed"""
+        with self._lock:
+            self._checked_at = time.time()
+            try:
+                with open(self.path, "r") as f:
+                    definitions = json.load(f)["templates"]
+                signature = self._signature_of(definitions)
+                if signature == self._signature:
+                    return False
+                templates = {}
+                for definition in definitions:
+                    screenshots = [self._screenshot(p) for p in self._source_files(definition)]
+                    templates[int(definition["id"])] = {**definition, "screenshots": screenshots}
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # Warn once per distinct problem rather than on every check
+                if str(e) != self._last_error:
+                    print(f"⚠️  Keeping previous templates, could not load {self.path}: {e}")
+                    self._last_error = str(e)
+                return False
+            self._last_error = None
+            self._templates = templates
+            self._signature = signature
+            print(f"🗂️  Loaded {len(templates)} templates")
+
+        if self.preupload and FAL_KEY:
+            paths = [shot["path"] for t in templates.values() for shot in t["screenshots"]]
+            executor.submit(self._upload, paths)
+        for listener in self.listeners:
+            listener()
+        return True
+
+    def _upload(self, paths: List[Path]):
+        for path in paths:
+            try:
+                upload_cache.upload(path)
+            except Exception as e:
+                print(f"⚠️  Could not pre-upload template screenshot {path.name}: {e}")
+
+    def _maybe_reload(self):
+        # Checked off the event loop; callers keep the current templates until it finishes
+        now = time.time()
+        if now - self._checked_at >= self.reload_seconds:
+            self._checked_at = now
+            executor.submit(self.reload)
+
+    def get(self, template_id: int) -> Optional[Dict[str, Any]]:
+        self._maybe_reload()
+        return self._templates.get(template_id)
+
+    def all(self) -> Dict[int, Dict[str, Any]]:
+        self._maybe_reload()
+        return dict(self._templates)
+
+    def summary(self, template: Dict[str, Any]) -> Dict[str, Any]:
+        """JSON-safe view of a template, with the current fal.ai URL of each screenshot"""
+        summary = {key: value for key, value in template.items() if key != "screenshots"}
+        summary["screenshots"] = [
+            {
+                "file": shot["file"],
+                "sha256": shot["sha256"],
+                "width": shot["width"],
+                "height": shot["height"],
+                "fal_url": upload_cache.get(shot["sha256"]),
+            }
+            for shot in template["screenshots"]
+        ]
+        return summary
+
+    def list(self) -> List[Dict[str, Any]]:
+        self._maybe_reload()
+        return [self.summary(t) for _, t in sorted(self._templates.items())]
+
+
+template_registry = TemplateRegistry(TEMPLATES_FILE, TEMPLATE_RELOAD_SECONDS, TEMPLATE_PREUPLOAD)
+
+
+def get_template(template_id: int) -> Dict[str, Any]:
+    template = template_registry.get(template_id)
+    if template is None:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+
+def template_preview_id(template: Dict[str, Any], idx: int) -> str:
+    """Preview ID of one template item, versioned by everything that shapes the image"""
+    screenshots = template["screenshots"]
+    shape = {
+        "caption": template["captions"][idx],
+        "settings": template["settings"],
+        "text_color": template.get("text_color"),
+        "text_position": template.get("text_position"),
+        "screenshot": screenshots[idx]["sha256"] if idx < len(screenshots) else None,
+    }
+    version = hashlib.sha256(json.dumps(shape, sort_keys=True).encode()).hexdigest()[:10]
+    return f"template_{template['id']}_preview_{idx}_{version}"
+
+
+async def generate_template_preview_item(template_id: int, idx: int) -> Dict[str, Any]:
+    """Generate one template preview"""
+    template = get_template(template_id)
+    caption = template["captions"][idx]
+    settings = template["settings"]
+    colors = settings["background_config"]["colors"]
+    rotation = settings["positioning"]["rotation"]
+
+    preview_id = template_preview_id(template, idx)
+    output_path = output_file(preview_id)
+    screenshots = template["screenshots"]
+    screenshot_path = screenshots[idx]["path"] if idx < len(screenshots) else None
+    result = {
+        "index": idx,
+        "preview_id": preview_id,
+        "caption": caption,
+        "download_url": f"/api/download/{preview_id}",
+        "screenshot_path": str(screenshot_path) if screenshot_path else None
+    }
+
+    # Skip if already generated
+    if find_output(preview_id):
+        return result
+
+    # For templates with source screenshots, use actual screenshots
+    if screenshot_path:
+        # Build prompt using saved template structure
+        prompt = compile_showcase_prompt(
+            colors[:2],
+            "iPhone 15 Pro",
+            rotation,
+            template.get("text_color", "white"),
+            f"at the {template.get('text_position', 'top')}",
+            caption,
+            template.get("prompt_config"),
+        )
+
+        print(f"🎨 Generating template {template_id} preview {idx + 1}: {caption}")
+
+        # Use alpha-image-232/edit-image to composite screenshot
+        generated = await run_flux(
+            "fal-ai/flux-2/edit",
+            {
+                "prompt": prompt.text,
+                "strength": 0.65,
+                "guidance_scale": 3.5,
+                "num_inference_steps": 28,
+                "seed": 12345 + idx,
+                "image_size": {"width": 1290, "height": 2796},
+                "enable_safety_checker": True,
+            },
+            [screenshot_path],
+            output_path,
+        )
+    else:
+        # Fallback to text-to-image for other templates
+        prompt = compile_text_to_image_prompt(colors[0], colors[1], caption)
+        generated = await run_flux(
+            "fal-ai/flux/schnell",
+            {
+                "prompt": prompt.text,
+                "image_size": {"width": 1290, "height": 2796},
+                "num_inference_steps": 4,
+                "seed": 12345 + idx,
+                "enable_safety_checker": True,
+            },
+            [],
+            output_path,
+        )
 
-@app.post("/api/generate-template-preview")
-async def generate_template_preview(request: TemplatePreviewRequest):
-    """Generate preview screenshots for a template using actual screenshots"""
-    try:
-        template_id = request.template_id
-
-        # Template source screenshots mapping (relative to project root)
-        project_root = Path(__file__).parent.parent
-        template_screenshots = {
-            2: [
-                project_root / "templates/weatherapp/IMG_5497-min.PNG",
-                project_root / "templates/weatherapp/IMG_5498-min.PNG",
-                project_root / "templates/weatherapp/IMG_5499-min.PNG",
-                project_root / "templates/weatherapp/IMG_5500-min.PNG",
-                project_root / "templates/weatherapp/IMG_5501.PNG"
-            ],
-            3: [
-                project_root / "templates/healthapp/IMG_5504-min.PNG",
-                project_root / "templates/healthapp/IMG_5505-min.PNG",
-                project_root / "templates/healthapp/IMG_5506-min.PNG",
-                project_root / "templates/healthapp/IMG_5507-min.PNG",
-                project_root / "templates/healthapp/IMG_5508-min.PNG"
-            ],
-            4: [
-                project_root / "templates/homeapp/IMG_5515-min.PNG",
-                project_root / "templates/homeapp/IMG_5516-min.PNG",
-                project_root / "templates/homeapp/IMG_5517-min.PNG",
-                project_root / "templates/homeapp/IMG_5518-min.PNG",
-                project_root / "templates/homeapp/IMG_5519-min.PNG"
-            ],
-            5: [
-                project_root / "templates/phillzcoffe/IMG_5520-min.PNG",
-                project_root / "templates/phillzcoffe/IMG_5521-min.PNG",
-                project_root / "templates/phillzcoffe/IMG_5522-min.PNG",
-                project_root / "templates/phillzcoffe/IMG_5523-min.PNG",
-                project_root / "templates/phillzcoffe/IMG_5524-min.PNG"
-            ],
-            6: [
-                project_root / "templates/roku/IMG_5525-min.PNG",
-                project_root / "templates/roku/IMG_5526-min.PNG",
-                project_root / "templates/roku/IMG_5527-min.PNG",
-                project_root / "templates/roku/IMG_5528-min.PNG",
-                project_root / "templates/roku/IMG_5529-min.PNG"
-            ],
-            7: [
-                project_root / "templates/newsapp/IMG_5531-min.PNG",
-                project_root / "templates/newsapp/IMG_5532-min.PNG",
-                project_root / "templates/newsapp/IMG_5533-min.PNG",
-                project_root / "templates/newsapp/IMG_5534-min.PNG",
-                project_root / "templates/newsapp/IMG_5535-min.PNG"
-            ]
-        }
+    if not generated:
+        raise Exception(f"Failed to generate preview {idx + 1}")
+    return result
 
-        template_captions = {
-            1: ["The app for FITNESS!", "1M+ happy USERS!", "Reduce stress with simple CHARTS!", "Your new program is WAITING!", "Track progress in REAL-TIME!"],
-            2: ["Weather that's always ACCURATE!", "Track conditions across CITIES!", "Customize settings your WAY!", "See precipitation in REAL-TIME!", "Detailed forecasts at a GLANCE!"],
-            3: ["Track your health GOALS!", "Achieve wellness SUCCESS!", "Monitor vitals DAILY!", "Your fitness journey STARTS here!", "Stay healthy and STRONG!"],
-            4: ["Control your home with EASE!", "Smart living starts HERE!", "Automate everything EFFORTLESSLY!", "Your comfort is PRIORITY!", "Home automation made SIMPLE!"],
-            5: ["Your daily coffee FIX!", "Order ahead and SKIP the line!", "Discover new FLAVORS!", "Personalize every SIP!", "Coffee made YOUR way!"],
-            6: ["Stream UNLIMITED entertainment!", "Thousands of channels at your FINGERTIPS!", "Watch what YOU love!", "Your streaming hub AWAITS!", "Entertainment made SIMPLE!"],
-            7: ["Stay INFORMED!", "Breaking news at your FINGERTIPS!", "Personalized STORIES!", "Never miss a HEADLINE!", "News that MATTERS!"]
-        }
 
-        template_settings = {
-            1: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#667eea", "#764ba2"]}, "positioning": {"scale": 0.85, "rotation": 0, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            2: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#4A90E2", "#50C9E8"]}, "positioning": {"scale": 0.85, "rotation": -2, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            3: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#DC143C", "#000000"]}, "positioning": {"scale": 0.85, "rotation": 2, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            4: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#FFFACD", "#FFFFFF"]}, "positioning": {"scale": 0.85, "rotation": 0, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            5: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#8B4513", "#D2691E"]}, "positioning": {"scale": 0.85, "rotation": 0, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            6: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#6A1B9A", "#9C27B0"]}, "positioning": {"scale": 0.85, "rotation": 0, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-            7: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#FF6B6B", "#FFE66D"]}, "positioning": {"scale": 0.85, "rotation": 10, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}}
-        }
+async def generate_template_previews(template_id: int, job_id: str, on_result=None, on_start=None) -> List[Dict[str, Any]]:
+    """Generate all previews of a template concurrently, in caption order.
 
-        if template_id not in template_captions:
-            raise HTTPException(status_code=404, detail="Template not found")
-
-        captions = template_captions[template_id]
-        settings = template_settings[template_id]
-        colors = settings["background_config"]["colors"]
-        rotation = settings["positioning"]["rotation"]
-
-        # Generate 5 preview screenshots using actual source screenshots
-        results = []
-        for idx, caption in enumerate(captions):
-            preview_id = f"template_{template_id}_preview_{idx}"
-            output_path = OUTPUT_DIR / f"{preview_id}.png"
-
-            # Skip if already generated
-            if output_path.exists():
-                screenshot_path = template_screenshots.get(template_id, [None] * 5)[idx]
-                results.append({
-                    "preview_id": preview_id,
-                    "caption": caption,
-                    "download_url": f"/api/download/{preview_id}",
-                    "screenshot_path": str(screenshot_path) if screenshot_path else None
-                })
-                continue
+    Concurrency is bounded by the scheduler's per-job limit. The coroutine
+    functions on_start and on_result are awaited once the first preview gets
+    a slot and with each preview as soon as it finishes.
+    """
+    generate = with_start_hook(generate_template_preview_item, on_start) if on_start else generate_template_preview_item
 
-            # For templates 2 and 3, use actual screenshots
-            if template_id in template_screenshots:
-                screenshot_path = template_screenshots[template_id][idx]
+    async def run_one(idx: int):
+        result = await scheduler.run(job_id, generate, template_id, idx)
+        if on_result:
+            await on_result(result)
+        return result
 
-                # Upload screenshot to fal.ai
-                image_url = fal_client.upload_file(str(screenshot_path))
-                print(f"📤 Uploaded screenshot: {screenshot_path.name}")
+    captions = get_template(template_id)["captions"]
+    return await asyncio.gather(*(run_one(idx) for idx in range(len(captions))))
 
-                # Build prompt using saved template structure
-                # Use black text for template 4 (home app), white text for others
-                text_color = "black" if template_id == 4 else "white"
-                # Use bottom text for template 7 (news app), top for others
-                text_position = "at the bottom" if template_id == 7 else "at the top"
-                prompt = f"Professional app store preview screenshot with smooth gradient background from {colors[0]} to {colors[1]}. Center the app screenshot in a realistic iPhone 15 Pro mockup with device frame, slightly tilted {rotation} degrees, with elegant drop shadow. Add large bold {text_color} text overlay {text_position} reading \"{caption}\" with subtle shadow for depth. Clean modern app store marketing aesthetic, professional composition."
 
-                print(f"🎨 Generating template {template_id} preview {idx + 1}: {caption}")
+async def process_template_preview_job(job_id: str, template_id: int):
+    """Generate template previews in the background, publishing each one as it finishes"""
+    try:
+        results = await generate_template_previews(
+            template_id,
+            job_id,
+            on_result=lambda result: record_progress(job_id, result),
+            on_start=lambda: update_job(job_id, status="processing"),
+        )
+        await update_job(
+            job_id,
+            status="completed",
+            progress=100,
+            results=results,
+            completed_at=datetime.now().isoformat(),
+        )
+    except Exception as e:
+        await update_job(job_id, status="failed", error=str(e))
 
-                # Use alpha-image-232/edit-image to composite screenshot
-                result = fal_client.subscribe(
-                    "fal-ai/flux-2/edit",
-                    arguments={
-                        "prompt": prompt,
-                        "image_urls": [image_url],
-                        "strength": 0.65,
-                        "guidance_scale": 3.5,
-                        "num_inference_steps": 28,
-                        "seed": 12345 + idx,
-                        "image_size": {"width": 1290, "height": 2796},
-                        "enable_safety_checker": True,
-                    },
-                )
-            else:
-                # Fallback to text-to-image for other templates
-                prompt = f"Professional app store preview with gradient {colors[0]} to {colors[1]}, iPhone mockup, text \"{caption}\""
-                result = fal_client.subscribe(
-                    "fal-ai/flux/schnell",
-                    arguments={
-                        "prompt": prompt,
-                        "image_size": {"width": 1290, "height": 2796},
-                        "num_inference_steps": 4,
-                        "seed": 12345 + idx,
-                        "enable_safety_checker": True,
-                    },
-                )
 
-            # Download and save result
-            if result and "images" in result and len(result["images"]) > 0:
-                generated_url = result["images"][0]["url"]
-                response = requests.get(generated_url)
-                with open(output_path, "wb") as f:
-                    f.write(response.content)
-
-                results.append({
-                    "preview_id": preview_id,
-                    "caption": caption,
-                    "download_url": f"/api/download/{preview_id}",
-                    "screenshot_path": str(screenshot_path) if 'screenshot_path' in locals() else None
-                })
-            else:
-                raise Exception(f"Failed to generate preview {idx + 1}")
+@app.post("/api/generate-template-preview")
+async def generate_template_preview(request: TemplatePreviewRequest, background_tasks: BackgroundTasks):
+    """Generate preview screenshots for a template using actual screenshots.
+
+    With background=true a job ID is returned immediately and previews show up
+    in /api/status/{job_id} as they finish.
+    """
+    template_id = request.template_id
+    count = len(get_template(template_id)["captions"])
+    admit(count)
+
+    if request.background:
+        job_id = str(uuid.uuid4())
+        await run_blocking(job_store.create, new_job(job_id, count))
+        background_tasks.add_task(process_template_preview_job, job_id, template_id)
+        return {"success": True, "job_id": job_id, "template_id": template_id}
 
+    try:
+        results = await generate_template_previews(template_id, f"template_{template_id}")
         return {
             "success": True,
             "template_id": template_id,
             "previews": results
         }
-
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Opt-in: generate every template preview in the background at startup and
+# whenever the template registry changes, TEMPLATE_PREWARM_CONCURRENCY at a time.
+TEMPLATE_PREWARM = os.getenv("TEMPLATE_PREWARM", "0") == "1"
+TEMPLATE_PREWARM_CONCURRENCY = int(os.getenv("TEMPLATE_PREWARM_CONCURRENCY", "2"))
+
+
+class TemplatePrewarmer:
+    """Fills the output directory with template previews before anyone asks.
+
+    Runs at background priority through the scheduler, so user requests go
+    first. A registry change during a run starts another pass once it ends;
+    previews that already exist are skipped.
+    """
+
+    MAX_ERRORS = 5
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.state = "idle"
+        self.total = 0
+        self.cached = 0
+        self.generated = 0
+        self.failed = 0
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.errors: deque = deque(maxlen=self.MAX_ERRORS)
+        self._task: Optional[asyncio.Task] = None
+        self._again = False
+
+    def start(self):
+        """Start a pass, or queue one behind the pass already running. Call from the event loop."""
+        if self._task and not self._task.done():
+            self._again = True
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def watch(self, registry: TemplateRegistry):
+        loop = asyncio.get_running_loop()
+        registry.listeners.append(lambda: loop.call_soon_threadsafe(self.start))
+
+    async def _run(self):
+        self._again = True
+        while self._again:
+            self._again = False
+            await self._pass()
+
+    async def _pass(self):
+        items = [(template_id, idx) for template_id, template in sorted(template_registry.all().items())
+                 for idx in range(len(template["captions"]))]
+        self.state = "running"
+        self.total, self.cached, self.generated, self.failed = len(items), 0, 0, 0
+        self.started_at, self.finished_at = datetime.now().isoformat(), None
+        print(f"🔥 Prewarming {len(items)} template previews")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def warm(template_id: int, idx: int):
+            async with semaphore:
+                template = template_registry.get(template_id)
+                if template is None or idx >= len(template["captions"]):
+                    self.total -= 1  # Removed by a reload since the pass started
+                    return
+                if find_output(template_preview_id(template, idx)):
+                    self.cached += 1
+                    return
+                try:
+                    await scheduler.run(
+                        "template_prewarm", generate_template_preview_item, template_id, idx,
+                        priority=PRIORITY_BACKGROUND,
+                    )
+                    self.generated += 1
+                except Exception as e:
+                    self.failed += 1
+                    self.errors.append(f"template {template_id} preview {idx + 1}: {e}")
+
+        await asyncio.gather(*(warm(template_id, idx) for template_id, idx in items))
+        self.state = "warm" if not self.failed else "partial"
+        self.finished_at = datetime.now().isoformat()
+        print(f"🔥 Template prewarm {self.state}: {self.generated} generated, {self.cached} cached, {self.failed} failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": TEMPLATE_PREWARM,
+            "state": self.state,
+            "total": self.total,
+            "done": self.cached + self.generated + self.failed,
+            "cached": self.cached,
+            "generated": self.generated,
+            "failed": self.failed,
+            "concurrency": self.concurrency,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "errors": list(self.errors),
+        }
+
+
+template_prewarmer = TemplatePrewarmer(TEMPLATE_PREWARM_CONCURRENCY)
+
+
+@app.on_event("startup")
+async def start_template_prewarm():
+    if TEMPLATE_PREWARM:
+        template_prewarmer.watch(template_registry)
+        template_prewarmer.start()
+
+
 class EditPreviewRequest(BaseModel):
     screenshot_path: str
     caption: str
@@ -416,35 +2337,24 @@ class EditPreviewRequest(BaseModel):
     background_image_id: Optional[str] = None
 
 
-def generate_preview_sync(request: EditPreviewRequest, preview_id: str, output_path: Path, screenshot_file: Path):
-    """Synchronous function to generate preview - runs in thread pool"""
+async def render_edit_preview(request: EditPreviewRequest, preview_id: str, output_path: Path, screenshot_file: Path):
+    """Generate an edited template preview with FLUX"""
     try:
-        # Upload screenshot to fal.ai
-        image_url = fal_client.upload_file(str(screenshot_file))
-        print(f"📤 Uploaded screenshot for editing: {screenshot_file.name}")
-
         # Build prompt based on settings
         rotation = request.positioning.get("rotation", 0)
 
         # Handle background image if provided
-        image_urls = [image_url]
+        image_files = [normalized_upload(screenshot_file)]
         if request.background_type == "image" and request.background_image_id:
-            # Find and upload background image
-            bg_file = None
-            for ext in [".png", ".jpg", ".jpeg", ".webp"]:
-                bg_path = UPLOAD_DIR / f"bg_{request.background_image_id}{ext}"
-                if bg_path.exists():
-                    bg_file = bg_path
-                    break
-
+            # Find background image
+            bg_file = await run_blocking(find_upload, request.background_image_id, "bg_")
             if bg_file:
-                bg_image_url = fal_client.upload_file(str(bg_file))
                 # Use explicit image indexing: image 1 = background, image 2 = screenshot
-                image_urls = [bg_image_url, image_url]
-                print(f"📤 Uploaded background image: {bg_file.name}")
+                image_files = [normalized_upload(bg_file), normalized_upload(screenshot_file)]
+                print(f"🖼️  Using background image: {bg_file.name}")
                 text_color = request.text_color or "white"
                 # Use explicit image indexing as per FLUX capabilities
-                prompt = f"Use image 1 as the background. Place the app screenshot from image 2 in a realistic {request.device_frame} mockup with device frame, centered on the background, slightly tilted {rotation} degrees, with elegant drop shadow. Add large bold {text_color} text overlay at the {request.text_position} reading \"{request.caption}\" with subtle shadow for depth. Professional app store marketing aesthetic, clean composition."
+                prompt = compile_backdrop_prompt(request.device_frame, freeze(rotation), text_color, request.text_position, request.caption)
             else:
                 print(f"⚠️  Background image not found, falling back to gradient")
                 request.background_type = "gradient"
@@ -466,21 +2376,21 @@ def generate_preview_sync(request: EditPreviewRequest, preview_id: str, output_p
             text_position_str = "at the bottom" if request.text_position == "bottom" else "at the top"
 
             if request.background_type == "gradient":
-                prompt = f"Professional app store preview screenshot with smooth gradient background from {colors[0]} to {colors[1]}. Center the app screenshot in a realistic {request.device_frame} mockup with device frame, slightly tilted {rotation} degrees, with elegant drop shadow. Add large bold {text_color} text overlay {text_position_str} reading \"{request.caption}\" with subtle shadow for depth. Clean modern app store marketing aesthetic, professional composition."
+                background = colors[:2]
             else:  # solid
-                color = request.background_config.get("color", colors[0])
-                prompt = f"Professional app store preview screenshot with solid {color} background. Center the app screenshot in a realistic {request.device_frame} mockup with device frame, slightly tilted {rotation} degrees, with elegant drop shadow. Add large bold {text_color} text overlay {text_position_str} reading \"{request.caption}\" with subtle shadow for depth. Clean modern app store marketing aesthetic, professional composition."
+                background = [request.background_config.get("color", colors[0])]
+            prompt = compile_showcase_prompt(background, request.device_frame, rotation, text_color, text_position_str, request.caption)
 
         print(f"🎨 Generating edited preview with caption: {request.caption}")
         print(f"🖼️  Background type: {request.background_type}")
 
         # Use alpha-image-232/edit-image to composite screenshot
-        # image_urls now contains either [screenshot] or [background, screenshot]
-        result = fal_client.subscribe(
+        # image_files now contains either [screenshot] or [background, screenshot]
+        # The seed is random on purpose, so there is nothing to gain from caching
+        generated = await run_flux(
             "fal-ai/flux-2/edit",
-            arguments={
-                "prompt": prompt,
-                "image_urls": image_urls,
+            {
+                "prompt": prompt.text,
                 "strength": 0.65,
                 "guidance_scale": 3.5,
                 "num_inference_steps": 28,
@@ -488,15 +2398,13 @@ def generate_preview_sync(request: EditPreviewRequest, preview_id: str, output_p
                 "image_size": {"width": 1290, "height": 2796},
                 "enable_safety_checker": True,
             },
+            image_files,
+            output_path,
+            use_cache=False,
         )
 
         # Download and save result
-        if result and "images" in result and len(result["images"]) > 0:
-            generated_url = result["images"][0]["url"]
-            response = requests.get(generated_url)
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-
+        if generated:
             print(f"✅ Edited preview saved: {preview_id}")
             return {
                 "success": True,
@@ -519,241 +2427,504 @@ async def edit_preview_new(request: EditPreviewRequest):
         timestamp = int(time.time() * 1000)
         random_suffix = random.randint(1000, 9999)
         preview_id = f"edited_preview_{timestamp}_{random_suffix}"
-        output_path = OUTPUT_DIR / f"{preview_id}.png"
+        output_path = output_file(preview_id)
 
         # Parse screenshot path to get the actual file
         screenshot_file = Path(request.screenshot_path)
 
         # If it's just a filename, look in UPLOAD_DIR
         if not screenshot_file.is_absolute() and screenshot_file.parent == Path('.'):
-            screenshot_file = UPLOAD_DIR / screenshot_file.name
+            screenshot_file = await run_blocking(find_upload, screenshot_file.stem) or UPLOAD_DIR / screenshot_file.name
         # If it's a relative path with directories, resolve from project root
         elif not screenshot_file.is_absolute():
-            project_root = Path(__file__).parent.parent
-            screenshot_file = project_root / request.screenshot_path
+            screenshot_file = PROJECT_ROOT / request.screenshot_path
 
         if not screenshot_file.exists():
             raise HTTPException(status_code=404, detail=f"Screenshot not found: {screenshot_file}")
 
-        # Run the blocking fal_client call in thread pool to avoid blocking event loop
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            executor,
-            generate_preview_sync,
+        # Queue through the scheduler ahead of batch work
+        admit()
+        result = await scheduler.run(
+            preview_id,
+            render_edit_preview,
             request,
             preview_id,
             output_path,
-            screenshot_file
+            screenshot_file,
+            priority=PRIORITY_INTERACTIVE
         )
 
         return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ Error editing preview: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/api/generate-caption/{screenshot_id}")
-async def generate_caption(screenshot_id: str):
-    """Generate AI caption for a screenshot using vision AI"""
-    try:
-        # Find screenshot file
-        screenshot_path = None
-        for ext in [".png", ".jpg", ".jpeg", ".webp"]:
-            path = UPLOAD_DIR / f"{screenshot_id}{ext}"
-            if path.exists():
-                screenshot_path = path
-                break
+CAPTION_MODEL = "fal-ai/llava-next"
+CAPTION_PROMPT = "Analyze this app screenshot and create a short, exciting marketing caption (5-8 words) that highlights the main feature or benefit. Format: Start with an action verb, describe the benefit, and END with 1-2 words in ALL CAPS for emphasis. Example: 'Design your dream outfit in MINUTES!' or 'Track your progress in REAL-TIME!' Only return the caption text, nothing else."
+CAPTION_MAX_TOKENS = 30
+# Cached captions are only reused for the same model, prompt and settings
+CAPTION_PROMPT_VERSION = hashlib.sha256(
+    json.dumps([CAPTION_MODEL, CAPTION_PROMPT, CAPTION_MAX_TOKENS]).encode()
+).hexdigest()[:12]
+
+# /api/generate-captions runs at most CAPTION_BATCH_CONCURRENCY vision calls at once
+CAPTION_BATCH_CONCURRENCY = int(os.getenv("CAPTION_BATCH_CONCURRENCY", "4"))
+CAPTION_BATCH_MAX = int(os.getenv("CAPTION_BATCH_MAX", "50"))
+
+
+class CaptionCache:
+    """Vision captions in SQLite, keyed by image content hash and prompt version"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS captions (
+                sha256 TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (sha256, prompt_version)
+            )
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+        return conn
+
+    def get(self, sha: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT caption FROM captions WHERE sha256 = ? AND prompt_version = ?",
+            (sha, CAPTION_PROMPT_VERSION),
+        ).fetchone()
+        self._count(row is not None)
+        return row[0] if row else None
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
 
-        if not screenshot_path:
-            raise HTTPException(status_code=404, detail="Screenshot not found")
+    def put(self, sha: str, caption: str):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO captions VALUES (?, ?, ?, ?)",
+            (sha, CAPTION_PROMPT_VERSION, caption, time.time()),
+        )
 
-        # Upload to fal.ai
-        image_url = fal_client.upload_file(str(screenshot_path))
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "prompt_version": CAPTION_PROMPT_VERSION,
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total else 0.0,
+        }
 
-        # Use fal.ai's vision model to analyze and generate caption
-        # Using LLaVA or similar vision-language model available on fal.ai
-        try:
-            result = fal_client.subscribe(
-                "fal-ai/llava-next",
-                arguments={
-                    "image_url": image_url,
-                    "prompt": "Analyze this app screenshot and create a short, exciting marketing caption (5-8 words) that highlights the main feature or benefit. Format: Start with an action verb, describe the benefit, and END with 1-2 words in ALL CAPS for emphasis. Example: 'Design your dream outfit in MINUTES!' or 'Track your progress in REAL-TIME!' Only return the caption text, nothing else.",
-                    "max_tokens": 30,
-                },
-            )
 
-            if result and "output" in result:
-                caption = result["output"].strip().strip('"').strip("'")
+caption_cache = CaptionCache(USER_DATA_DIR / "captions.db")
 
-                # Ensure the caption follows the format (capitalize last 1-2 words if not already)
-                words = caption.split()
-                if len(words) >= 2:
-                    # Capitalize last word if it's not already uppercase and seems like emphasis
-                    if not words[-1].isupper() and len(words[-1]) > 2:
-                        words[-1] = words[-1].upper()
-                    caption = " ".join(words)
 
-                # Clean up if it's too long
-                if len(caption) > 80:
-                    caption = caption[:77] + "..."
-            else:
-                # Fallback caption
-                caption = "Transform your experience TODAY!"
+def caption_response(caption: str, cached: bool = False) -> Dict[str, Any]:
+    return {
+        "success": True,
+        "caption": caption,
+        "cached": cached,
+        "position": "top",
+        "font_size": 80,
+        "color": "#FFFFFF"
+    }
 
-        except Exception as e:
-            print(f"Vision model error: {e}, using fallback")
-            # Smart fallback captions with emphasis on last word (ASO optimized)
-            captions = [
-                "Design your dream in MINUTES!",
-                "Create stunning content in SECONDS!",
-                "Transform your workflow with EASE!",
-                "Boost productivity by 10X!",
-                "Unlock unlimited POSSIBILITIES!",
-                "Build amazing projects FASTER!",
-                "Experience the power of AUTOMATION!",
-                "Organize everything in ONE PLACE!",
-                "Collaborate with your team INSTANTLY!",
-                "Track your progress in REAL-TIME!",
-                "Simplify complex tasks with AI!",
-                "Master new skills EFFORTLESSLY!",
-                "Connect with millions WORLDWIDE!",
-                "Achieve your goals FASTER!",
-                "Save hours every WEEK!",
-                "Get instant results with PRECISION!",
-                "Work smarter, not HARDER!",
-                "Unleash your creative GENIUS!",
-                "Scale your business with CONFIDENCE!",
-                "Make data-driven decisions INSTANTLY!"
-            ]
-            import random
-            caption = random.choice(captions)
 
-        return {
-            "success": True,
-            "caption": caption,
-            "position": "top",
-            "font_size": 80,
-            "color": "#FFFFFF"
-        }
+def screenshot_content_hash(screenshot_id: str) -> tuple:
+    """Path of the image sent to the vision model and its SHA-256"""
+    screenshot_path = find_upload(screenshot_id)
+    if not screenshot_path:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    vision_path = normalized_upload(screenshot_path)
+    return vision_path, upload_cache.content_hash(vision_path)
+
+
+async def caption_screenshot(screenshot_id: str):
+    """Generate a marketing caption for an uploaded screenshot"""
+    # Find screenshot file
+    vision_path, sha = await run_blocking(screenshot_content_hash, screenshot_id)
+    cached = await run_blocking(caption_cache.get, sha)
+    if cached is not None:
+        return caption_response(cached, cached=True)
+
+    # Upload to fal.ai
+    image_url, _ = await upload_cache.upload_async(vision_path)
+
+    # Use fal.ai's vision model to analyze and generate caption
+    # Using LLaVA or similar vision-language model available on fal.ai
+    try:
+        result = await fal_poller.run(
+            CAPTION_MODEL,
+            {
+                "image_url": image_url,
+                "prompt": CAPTION_PROMPT,
+                "max_tokens": CAPTION_MAX_TOKENS,
+            },
+        )
+
+        if result and "output" in result:
+            caption = result["output"].strip().strip('"').strip("'")
+
+            # Ensure the caption follows the format (capitalize last 1-2 words if not already)
+            words = caption.split()
+            if len(words) >= 2:
+                # Capitalize last word if it's not already uppercase and seems like emphasis
+                if not words[-1].isupper() and len(words[-1]) > 2:
+                    words[-1] = words[-1].upper()
+                caption = " ".join(words)
+
+            # Clean up if it's too long
+            if len(caption) > 80:
+                caption = caption[:77] + "..."
+            await run_blocking(caption_cache.put, sha, caption)
+        else:
+            # Fallback caption
+            caption = "Transform your experience TODAY!"
+
+    except Exception as e:
+        print(f"Vision model error: {e}, using fallback")
+        # Smart fallback captions with emphasis on last word (ASO optimized)
+        captions = [
+            "Design your dream in MINUTES!",
+            "Create stunning content in SECONDS!",
+            "Transform your workflow with EASE!",
+            "Boost productivity by 10X!",
+            "Unlock unlimited POSSIBILITIES!",
+            "Build amazing projects FASTER!",
+            "Experience the power of AUTOMATION!",
+            "Organize everything in ONE PLACE!",
+            "Collaborate with your team INSTANTLY!",
+            "Track your progress in REAL-TIME!",
+            "Simplify complex tasks with AI!",
+            "Master new skills EFFORTLESSLY!",
+            "Connect with millions WORLDWIDE!",
+            "Achieve your goals FASTER!",
+            "Save hours every WEEK!",
+            "Get instant results with PRECISION!",
+            "Work smarter, not HARDER!",
+            "Unleash your creative GENIUS!",
+            "Scale your business with CONFIDENCE!",
+            "Make data-driven decisions INSTANTLY!"
+        ]
+        import random
+        caption = random.choice(captions)
+
+    return caption_response(caption)
+
+
+class CaptionBatchRequest(BaseModel):
+    screenshot_ids: List[str]
+
+
+@app.post("/api/generate-captions")
+async def generate_captions(request: CaptionBatchRequest):
+    """Caption several screenshots, streaming one NDJSON line per screenshot as each finishes.
+
+    Lines carry the screenshot's index and id plus the generate-caption
+    fields, or success false and an error.
+    """
+    ids = request.screenshot_ids
+    if not ids:
+        raise HTTPException(status_code=400, detail="screenshot_ids is empty")
+    if len(ids) > CAPTION_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {CAPTION_BATCH_MAX} screenshots per request")
+    unique_ids = list(dict.fromkeys(ids))
+    admit(len(unique_ids))
+
+    batch_id = f"captions_{uuid.uuid4().hex}"
+    semaphore = asyncio.Semaphore(CAPTION_BATCH_CONCURRENCY)
+
+    async def caption_one(screenshot_id: str) -> tuple:
+        async with semaphore:
+            try:
+                result = await scheduler.run(batch_id, caption_screenshot, screenshot_id, priority=PRIORITY_INTERACTIVE)
+            except HTTPException as e:
+                result = {"success": False, "error": e.detail}
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            return screenshot_id, result
+
+    async def lines():
+        tasks = [asyncio.create_task(caption_one(screenshot_id)) for screenshot_id in unique_ids]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                screenshot_id, result = await finished
+                for index, requested_id in enumerate(ids):
+                    if requested_id == screenshot_id:
+                        yield json.dumps({"index": index, "screenshot_id": screenshot_id, **result}) + "\n"
+        finally:
+            # Client went away: stop work that hasn't started yet
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 
+@app.post("/api/generate-caption/{screenshot_id}")
+async def generate_caption(screenshot_id: str):
+    """Generate AI caption for a screenshot using vision AI"""
+    admit()
+    try:
+        return await scheduler.run(
+            f"caption_{screenshot_id}", caption_screenshot, screenshot_id, priority=PRIORITY_INTERACTIVE
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/api/templates/{template_id}")
-async def get_template_info(template_id: int):
-    """Get template configuration including prompt structure"""
-    template_captions = {
-        1: ["The app for FITNESS!", "1M+ happy USERS!", "Reduce stress with simple CHARTS!", "Your new program is WAITING!", "Track progress in REAL-TIME!"],
-        2: ["Weather that's always ACCURATE!", "Track conditions across CITIES!", "Customize settings your WAY!", "See precipitation in REAL-TIME!", "Detailed forecasts at a GLANCE!"]
+@app.get("/api/templates")
+async def list_templates():
+    """All templates with their captions, settings and screenshot facts"""
+    return {
+        "success": True,
+        "templates": await run_blocking(template_registry.list)
     }
 
-    template_settings = {
-        1: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#667eea", "#764ba2"]}, "positioning": {"scale": 0.85, "rotation": 0, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}},
-        2: {"device_frame": "iphone-15-pro", "background_type": "gradient", "background_config": {"colors": ["#4A90E2", "#50C9E8"]}, "positioning": {"scale": 0.85, "rotation": -2, "x_offset": 0, "y_offset": 0, "shadow": True, "reflection": False}}
-    }
 
-    if template_id not in template_captions:
-        raise HTTPException(status_code=404, detail="Template not found")
+@app.get("/api/templates/prewarm")
+async def get_template_prewarm():
+    """Progress of the template preview prewarm (state is idle, running, warm or partial)"""
+    return template_prewarmer.stats()
 
+
+@app.get("/api/templates/{template_id}")
+async def get_template_info(template_id: int):
+    """Get template configuration including prompt structure"""
+    template = get_template(template_id)
     return {
         "template_id": template_id,
-        "captions": template_captions[template_id],
-        "settings": template_settings[template_id],
-        "prompt_config": TEMPLATE_PROMPTS.get(template_id, None)
+        "captions": template["captions"],
+        "settings": template["settings"],
+        "prompt_config": template.get("prompt_config"),
+        "screenshots": (await run_blocking(template_registry.summary, template))["screenshots"]
     }
 
+def remove_result_outputs(results: List[Dict[str, Any]]):
+    """Delete every image the job results produced: each size and each locale's caption"""
+    for result in results:
+        # With captions, result_previews lists the locales but not the text-free renders under them
+        base = {key: value for key, value in result.items() if key != "locales"}
+        previews = result_previews(base) + result_previews(result)
+        paths = [find_output(preview_id) for preview_id, _ in previews]
+        if "path" in result:
+            paths.append(Path(result["path"]))
+        for path in paths:
+            try:
+                if path:
+                    path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+
 @app.delete("/api/cleanup/{job_id}")
 async def cleanup_job(job_id: str):
     """Clean up job data"""
-    if job_id in jobs_db:
-        job = jobs_db[job_id]
-        for result in job.get("results", []):
-            if "path" in result:
-                try:
-                    Path(result["path"]).unlink(missing_ok=True)
-                except:
-                    pass
-        del jobs_db[job_id]
+    job = job_store.get(job_id)
+    if job is not None:
+        await run_blocking(remove_result_outputs, job.get("results", []))
+        await run_blocking(job_store.delete, job_id)
         return {"success": True}
     raise HTTPException(status_code=404, detail="Job not found")
 
 
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-# Thread pool for running blocking fal_client calls concurrently
-executor = ThreadPoolExecutor(max_workers=10)
-
-def process_screenshot_sync(job_id: str, idx: int, screenshot, request: GenerationRequest):
-    """Synchronous function to process a single screenshot - runs in thread pool"""
+async def derive_sizes(request: GenerationRequest, presets: List[str], master_preset: str, master_id: str, screenshot_path: Path, text_overlay, draw_caption: bool = True) -> Dict[str, Any]:
+    """Produce every preset of a screenshot from its master preview.
+
+    Local renders are cheap, so they are redone at each size; FLUX masters
+    are cropped or padded with derive_size.
+    """
+    master_path = find_output(master_id)
+    sizes = {}
+    for preset in presets:
+        preview_id = master_id
+        if preset != master_preset:
+            preview_id = f"{master_id}_{preset}"
+            path = output_file(preview_id)
+            if request.render_mode == "local":
+                with stage("render"):
+                    await run_blocking(render_local_preview, request, screenshot_path, text_overlay, path, preset, draw_caption)
+            else:
+                with stage("derive"):
+                    await run_blocking(derive_size, master_path, get_output_size(preset), path)
+        width, height = get_output_size(preset)
+        sizes[preset] = {
+            "preview_id": preview_id,
+            "download_url": f"/api/download/{preview_id}",
+            "width": width,
+            "height": height,
+        }
+    return sizes
+
+
+def caption_style(text_overlay: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Position, size and color of a screenshot's caption, without the text"""
+    style = {"position": "top", "font_size": 80, "color": "#FFFFFF", **(text_overlay or {})}
+    style.pop("text", None)
+    return style
+
+
+def tallest_caption(style: Dict[str, Any], captions: List[str], size: tuple) -> Optional[Dict[str, Any]]:
+    """The text overlay that needs the most room on this canvas"""
+    overlays = [{**style, "text": caption} for caption in captions if caption]
+    return max(overlays, key=lambda overlay: layout_text(overlay, size)["height"], default=None)
+
+
+def render_caption(base_path: Path, text_overlay: Dict[str, Any], output_path: Path):
+    """Draw a caption over a text-free render"""
+    with Image.open(base_path) as base:
+        canvas = base.convert("RGBA")
+    layout = layout_text(text_overlay, canvas.size)
+    if layout:
+        draw_text(canvas, layout)
+    canvas.convert("RGB").save(output_path, "PNG", optimize=False, compress_level=3)
+
+
+async def render_locales(request: GenerationRequest, idx: int, style: Dict[str, Any], master_preset: str, base_ids: Dict[str, str]) -> Dict[str, Any]:
+    """Caption every size of a screenshot in every locale, in parallel"""
+    jobs = []
+    for locale, captions in request.captions.items():
+        overlay = {**style, "text": captions[idx]}
+        for preset, base_id in base_ids.items():
+            jobs.append((locale, preset, f"{base_id}_{locale}", overlay, base_id))
+    with stage("render"):
+        await asyncio.gather(*(
+            run_blocking(render_caption, find_output(base_id), overlay, output_file(preview_id))
+            for _, _, preview_id, overlay, base_id in jobs
+        ))
+
+    locales: Dict[str, Any] = {}
+    for locale, preset, preview_id, _, _ in jobs:
+        entry = {"preview_id": preview_id, "download_url": f"/api/download/{preview_id}"}
+        if preset == master_preset:
+            locales.setdefault(locale, {}).update(entry)
+        if request.output_sizes:
+            locales.setdefault(locale, {}).setdefault("sizes", {})[preset] = entry
+    return locales
+
+
+async def process_screenshot(job_id: str, idx: int, screenshot, request: GenerationRequest):
+    """Process a single screenshot of a job"""
+    spans: Dict[str, float] = {}
+    current_spans.set(spans)
+    started = time.perf_counter()
     try:
         screenshot_id = screenshot.id
         text_overlay = screenshot.textOverlay
 
         # Find screenshot file
-        screenshot_path = None
-        for ext in [".png", ".jpg", ".jpeg", ".webp"]:
-            path = UPLOAD_DIR / f"{screenshot_id}{ext}"
-            if path.exists():
-                screenshot_path = path
-                break
-
+        screenshot_path = await run_blocking(find_upload, screenshot_id)
         if not screenshot_path:
             raise FileNotFoundError(f"Screenshot {screenshot_id} not found")
 
-        # Generate preview using FLUX
+        # Generate preview using FLUX or the local compositor. With several
+        # output sizes the largest is generated and the rest derived from it.
+        presets = list(dict.fromkeys(request.output_sizes or [request.output_size]))
+        master_preset = master_size_preset(presets)
         preview_id = str(uuid.uuid4())
-        output_path = OUTPUT_DIR / f"{preview_id}.png"
-
-        # Build FLUX prompt with per-screenshot text
-        prompt = build_flux_prompt(request, text_overlay)
-        size = get_output_size(request.output_size)
-
-        print(f"🎨 FLUX Prompt for screenshot {idx + 1}: {prompt}")
-
-        # Upload image to fal.ai storage and get URL
-        image_url = fal_client.upload_file(str(screenshot_path))
-
-        print(f"📤 Uploaded to: {image_url}")
-
-        # Use consistent seed for reproducible results
-        # Generate seed from job_id for consistency across the job
-        seed = int(job_id.replace("-", "")[:8], 16) % (2**32)
+        output_path = output_file(preview_id)
+        size = get_output_size(master_preset)
+
+        # In locale mode the composition is rendered once without text, leaving
+        # room for the tallest caption, and each locale's caption drawn on top
+        draw_caption = not request.captions
+        if request.captions:
+            style = caption_style(text_overlay)
+            text_overlay = tallest_caption(style, [captions[idx] for captions in request.captions.values()], size)
+
+        if request.render_mode == "local":
+            with stage("render"):
+                await run_blocking(render_local_preview, request, screenshot_path, text_overlay, output_path, master_preset, draw_caption)
+            generated = True
+        else:
+            # Build FLUX prompt with per-screenshot text
+            if draw_caption:
+                prompt = compile_generation_prompt(request, text_overlay)
+            else:
+                prompt = compile_generation_prompt(request, caption_space=style["position"])
+            flux_input = normalized_upload(screenshot_path)
+            local_render = None
+            strength = 0.65
+            if request.render_mode == "local+flux-polish":
+                # Compose locally, then let FLUX only refine the look of it
+                flux_input = local_render = output_file(preview_id, "_local.png")
+                with stage("render"):
+                    await run_blocking(render_local_preview, request, screenshot_path, text_overlay, flux_input, master_preset, draw_caption)
+                prompt = compiled(FLUX_POLISH_PROMPT)
+                strength = 0.35
+
+            print(f"🎨 FLUX Prompt for screenshot {idx + 1} ({prompt.hash[:12]}): {prompt.text}")
+
+            # Seed from the request, or else from the screenshot and prompt, so an
+            # identical screenshot and prompt hits the result cache in any job
+            if request.seed is not None:
+                seed = (request.seed + idx) % (2**32)
+            else:
+                screenshot_hash = await run_blocking(upload_cache.content_hash, screenshot_path)
+                seed = content_seed(screenshot_hash, prompt.hash)
 
-        # Call FLUX edit-image API with proper URL and seed
-        result = fal_client.subscribe(
-            "fal-ai/flux-2/edit",
-            arguments={
-                "prompt": prompt,
-                "image_urls": [image_url],  # Expects a list!
-                "strength": 0.65,
-                "guidance_scale": 3.5,
-                "num_inference_steps": 28,
-                "seed": seed + idx,  # Unique but deterministic seed per screenshot
-                "image_size": {"width": size[0], "height": size[1]},
-                "enable_safety_checker": True,
-            },
-        )
+            # Call FLUX edit-image API with the screenshot and seed
+            try:
+                generated = await run_flux(
+                    "fal-ai/flux-2/edit",
+                    {
+                        "prompt": prompt.text,
+                        "strength": strength,
+                        "guidance_scale": 3.5,
+                        "num_inference_steps": 28,
+                        "seed": seed,
+                        "image_size": {"width": size[0], "height": size[1]},
+                        "enable_safety_checker": True,
+                    },
+                    [flux_input],
+                    output_path,
+                )
+            finally:
+                if local_render:
+                    local_render.unlink(missing_ok=True)
 
         # Download and save result
-        if result and "images" in result and len(result["images"]) > 0:
-            generated_url = result["images"][0]["url"]
-            response = requests.get(generated_url)
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-
+        if generated:
             result_data = {
                 "preview_id": preview_id,
                 "screenshot_id": screenshot_id,
                 "path": str(output_path),
-                "download_url": f"/api/download/{preview_id}"
+                "download_url": f"/api/download/{preview_id}",
+                "render_mode": request.render_mode
             }
+            if request.render_mode != "local":
+                result_data["prompt_hash"] = prompt.hash
+            if request.output_sizes:
+                result_data["output_size"] = master_preset
+                result_data["sizes"] = await derive_sizes(request, presets, master_preset, preview_id, screenshot_path, text_overlay, draw_caption)
+            if request.captions:
+                base_ids = {preset: entry["preview_id"] for preset, entry in result_data.get("sizes", {master_preset: result_data}).items()}
+                result_data["locales"] = await render_locales(request, idx, style, master_preset, base_ids)
+            total = time.perf_counter() - started
+            screenshot_seconds.observe(request.render_mode, total)
+            result_data["timings"] = span_timings(spans, total)
 
             # Update progress atomically
-            jobs_db[job_id]["completed_screenshots"] = idx + 1
-            jobs_db[job_id]["progress"] = int((idx + 1) / len(request.screenshots) * 100)
+            await record_progress(job_id, result_data)
 
             return result_data
         else:
@@ -761,19 +2932,19 @@ def process_screenshot_sync(job_id: str, idx: int, screenshot, request: Generati
 
     except Exception as e:
         print(f"❌ Error processing screenshot {idx + 1}: {e}")
-        return {"screenshot_id": screenshot_id, "error": str(e)}
+        job_events.publish(job_id, {"type": "screenshot_failed", "screenshot_id": screenshot_id, "error": str(e)})
+        return {"screenshot_id": screenshot_id, "error": str(e), "timings": span_timings(spans, time.perf_counter() - started)}
 
 async def process_job(job_id: str, request: GenerationRequest):
     """Process generation job using FLUX - with TRUE concurrent processing"""
     try:
-        jobs_db[job_id]["status"] = "processing"
-
-        # Create tasks that run in thread pool for true parallelism
-        loop = asyncio.get_event_loop()
+        # Every screenshot is submitted to the fal.ai queue as soon as the
+        # scheduler admits it; the poller tracks them all from one task
+        process = with_start_hook(process_screenshot, lambda: update_job(job_id, status="processing"))
         tasks = [
-            loop.run_in_executor(
-                executor,
-                process_screenshot_sync,
+            scheduler.run(
+                job_id,
+                process,
                 job_id,
                 idx,
                 screenshot,
@@ -788,198 +2959,1106 @@ async def process_job(job_id: str, request: GenerationRequest):
         print(f"✅ Completed processing {len(results)} screenshots")
 
         # Mark complete
-        jobs_db[job_id]["status"] = "completed"
-        jobs_db[job_id]["progress"] = 100
-        jobs_db[job_id]["results"] = results
-        jobs_db[job_id]["completed_at"] = datetime.now().isoformat()
+        await update_job(
+            job_id,
+            status="completed",
+            progress=100,
+            results=results,
+            completed_at=datetime.now().isoformat(),
+        )
 
     except Exception as e:
-        jobs_db[job_id]["status"] = "failed"
-        jobs_db[job_id]["error"] = str(e)
+        await update_job(job_id, status="failed", error=str(e))
 
 
-# Template-specific prompt configurations for generating previews from user screenshots
-TEMPLATE_PROMPTS = {
-    2: {
-        "base_prompt": "Professional app store preview screenshot with smooth gradient background from {color_start} to {color_end}. Center the app screenshot in a realistic iPhone 15 Pro mockup with device frame, slightly tilted {rotation} degrees, with elegant drop shadow. {text_overlay}Clean modern app store marketing aesthetic, professional composition.",
-        "text_overlay_format": 'Add large bold white text overlay at the top reading "{text}" with subtle shadow for depth. '
-    }
+# Prompt compilation. Settings are normalized into hashable tuples and the
+# compiled prompts memoized on them, so the prefix shared by a job's
+# screenshots is built once. Every prompt carries a SHA-256 of its text, a
+# stable key for caching and deduplicating generations.
+PROMPT_CACHE_SIZE = int(os.getenv("PROMPT_CACHE_SIZE", "4096"))
+
+DEVICE_PROMPT_NAMES = {
+    "iphone-15-pro": "iPhone 15 Pro",
+    "iphone-15": "iPhone 15",
+    "android": "modern Android phone",
+    "ipad": "iPad Pro"
 }
 
-def build_flux_prompt(request: GenerationRequest, text_overlay: Optional[Dict[str, Any]] = None) -> str:
-    """Build FLUX prompt from settings and per-screenshot text"""
-    parts = []
+# Used by template previews and edits; a template's prompt_config in
+# templates.json overrides it and may also use {color_start} and {color_end}
+DEFAULT_PROMPT_CONFIG = {
+    "base_prompt": "Professional app store preview screenshot with {background}. Center the app screenshot in a realistic {device} mockup with device frame, slightly tilted {rotation} degrees, with elegant drop shadow. {text_overlay}Clean modern app store marketing aesthetic, professional composition.",
+    "text_overlay_format": 'Add large bold {text_color} text overlay {text_position} reading "{text}" with subtle shadow for depth. ',
+}
 
-    # Background
+BACKDROP_PROMPT = 'Use image 1 as the background. Place the app screenshot from image 2 in a realistic {device} mockup with device frame, centered on the background, slightly tilted {rotation} degrees, with elegant drop shadow. Add large bold {text_color} text overlay at the {text_position} reading "{text}" with subtle shadow for depth. Professional app store marketing aesthetic, clean composition.'
+TEXT_TO_IMAGE_PROMPT = 'Professional app store preview with gradient {color_start} to {color_end}, iPhone mockup, text "{text}"'
+QUALITY_PROMPT = "professional, clean, modern app store aesthetic, high quality"
+
+
+class CompiledPrompt(NamedTuple):
+    text: str
+    hash: str
+
+
+def compiled(text: str) -> CompiledPrompt:
+    return CompiledPrompt(text, hashlib.sha256(text.encode()).hexdigest())
+
+
+def freeze(value: Any) -> Any:
+    """Hashable form of JSON-like settings; dict key order doesn't matter"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class SceneSettings(NamedTuple):
+    """The settings of a GenerationRequest that every screenshot's prompt shares"""
+    background_type: str
+    background: tuple
+    device_frame: Optional[str]
+    scale: Any
+    x_offset: Any
+    y_offset: Any
+    rotation: Any
+    shadow: Any
+    reflection: Any
+
+
+def scene_settings(request: GenerationRequest) -> SceneSettings:
+    """Normalize a request to the values its prompt depends on, with defaults filled in"""
+    config = request.background_config
     if request.background_type == "ai-generated":
-        bg_prompt = request.background_config.get("prompt", "modern gradient background")
-        parts.append(f"App store preview with {bg_prompt}")
+        background = (config.get("prompt", "modern gradient background"),)
     elif request.background_type == "gradient":
-        colors = request.background_config.get("colors", ["#667eea", "#764ba2"])
-        parts.append(f"App store preview with smooth gradient background starting with color {colors[0]} and finishing with color {colors[1]}")
+        colors = config.get("colors", ["#667eea", "#764ba2"])
+        background = (colors[0], colors[1])
     elif request.background_type == "solid":
-        color = request.background_config.get("color", "#667eea")
-        parts.append(f"App store preview with solid background with color {color}")
+        background = (config.get("color", "#667eea"),)
+    else:
+        background = ()
+    positioning = request.positioning
+    return SceneSettings(
+        request.background_type,
+        freeze(background),
+        request.device_frame,
+        freeze(positioning.get("scale", 0.85)),
+        freeze(positioning.get("x_offset", 0)),
+        freeze(positioning.get("y_offset", 0)),
+        freeze(positioning.get("rotation", 0)),
+        freeze(positioning.get("shadow", True)),
+        freeze(positioning.get("reflection", False)),
+    )
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def scene_prompt(scene: SceneSettings) -> str:
+    """Background, device, positioning and effects: the prefix of every screenshot's prompt"""
+    parts = []
+
+    # Background
+    if scene.background_type == "ai-generated":
+        parts.append(f"App store preview with {scene.background[0]}")
+    elif scene.background_type == "gradient":
+        parts.append(f"App store preview with smooth gradient background starting with color {scene.background[0]} and finishing with color {scene.background[1]}")
+    elif scene.background_type == "solid":
+        parts.append(f"App store preview with solid background with color {scene.background[0]}")
     else:
         parts.append("App store preview with smooth gradient background starting with color #667eea and finishing with color #764ba2")
 
     # Device frame
-    if request.device_frame and request.device_frame != "none":
-        device_map = {
-            "iphone-15-pro": "iPhone 15 Pro",
-            "iphone-15": "iPhone 15",
-            "android": "modern Android phone",
-            "ipad": "iPad Pro"
-        }
-        device = device_map.get(request.device_frame, "smartphone")
+    if scene.device_frame and scene.device_frame != "none":
+        device = DEVICE_PROMPT_NAMES.get(scene.device_frame, "smartphone")
         parts.append(f"app screenshot in realistic {device} device frame")
     else:
         parts.append("app screenshot centered")
 
     # Positioning
-    scale = request.positioning.get("scale", 0.85)
-    if scale != 1.0:
-        size_descriptor = "large" if scale > 0.85 else "small" if scale < 0.75 else "medium"
+    if scene.scale != 1.0:
+        size_descriptor = "large" if scene.scale > 0.85 else "small" if scene.scale < 0.75 else "medium"
         parts.append(f"{size_descriptor} sized device")
 
-    x_offset = request.positioning.get("x_offset", 0)
-    y_offset = request.positioning.get("y_offset", 0)
-    if x_offset != 0 or y_offset != 0:
+    if scene.x_offset != 0 or scene.y_offset != 0:
         position_desc = []
-        if x_offset > 30:
+        if scene.x_offset > 30:
             position_desc.append("shifted right")
-        elif x_offset < -30:
+        elif scene.x_offset < -30:
             position_desc.append("shifted left")
-        if y_offset > 30:
+        if scene.y_offset > 30:
             position_desc.append("positioned lower")
-        elif y_offset < -30:
+        elif scene.y_offset < -30:
             position_desc.append("positioned higher")
         if position_desc:
             parts.append(", ".join(position_desc))
 
-    rotation = request.positioning.get("rotation", 0)
-    if rotation != 0:
-        parts.append(f"rotated {rotation} degrees")
+    if scene.rotation != 0:
+        parts.append(f"rotated {scene.rotation} degrees")
 
     # Effects
-    if request.positioning.get("shadow", True):
+    if scene.shadow:
         parts.append("elegant drop shadow")
-    if request.positioning.get("reflection", False):
+    if scene.reflection:
         parts.append("subtle reflection")
 
-    # Text overlay (per screenshot)
-    if text_overlay and text_overlay.get("text"):
-        text = text_overlay["text"]
-        position = text_overlay.get("position", "bottom")
+    return ", ".join(parts)
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _generation_prompt(scene: SceneSettings, text: Optional[str], position: Any, caption_space: Optional[str]) -> CompiledPrompt:
+    parts = [scene_prompt(scene)]
+    if text:
         parts.append(f'text overlay "{text}" positioned at the {position}')
+    elif caption_space:
+        parts.append(f"no text, empty space at the {caption_space} for a caption")
+    parts.append(QUALITY_PROMPT)
+    return compiled(", ".join(parts))
+
+
+def compile_generation_prompt(request: GenerationRequest, text_overlay: Optional[Dict[str, Any]] = None, caption_space: Optional[str] = None) -> CompiledPrompt:
+    """FLUX prompt for one screenshot of a generation request.
+
+    caption_space asks for an empty area at that position instead of text,
+    for captions drawn locally afterwards.
+    """
+    text = text_overlay.get("text") if text_overlay else None
+    position = freeze(text_overlay.get("position", "bottom")) if text else None
+    return _generation_prompt(scene_settings(request), text or None, position, None if text else caption_space)
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def _showcase_prompt(prompt_config: Optional[tuple], background: tuple, device: str, rotation: Any,
+                     text_color: str, text_position: str, text: str) -> CompiledPrompt:
+    config = dict(prompt_config) if prompt_config else DEFAULT_PROMPT_CONFIG
+    if len(background) == 2:
+        values = {"background": f"smooth gradient background from {background[0]} to {background[1]}",
+                  "color_start": background[0], "color_end": background[1]}
+    else:
+        values = {"background": f"solid {background[0]} background",
+                  "color_start": background[0], "color_end": background[0]}
+    values.update(device=device, rotation=rotation, text_color=text_color, text_position=text_position, text=text)
+    text_overlay = config["text_overlay_format"].format(**values)
+    return compiled(config["base_prompt"].format(text_overlay=text_overlay, **values))
 
-    # Quality
-    parts.append("professional, clean, modern app store aesthetic, high quality")
 
-    return ", ".join(parts)
+def compile_showcase_prompt(background: List[str], device: str, rotation: Any, text_color: str, text_position: str,
+                            text: str, prompt_config: Optional[Dict[str, str]] = None) -> CompiledPrompt:
+    """Template-style prompt: the screenshot in a tilted device over a gradient
+    (two colors) or solid (one color) background, with a bold caption.
+
+    text_position is a phrase such as "at the top".
+    """
+    return _showcase_prompt(freeze(prompt_config), freeze(background), device, freeze(rotation), text_color, text_position, text)
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def compile_backdrop_prompt(device: str, rotation: Any, text_color: str, text_position: str, text: str) -> CompiledPrompt:
+    """Prompt for compositing the screenshot (image 2) over a background image (image 1)"""
+    return compiled(BACKDROP_PROMPT.format(device=device, rotation=rotation, text_color=text_color, text_position=text_position, text=text))
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def compile_text_to_image_prompt(color_start: str, color_end: str, text: str) -> CompiledPrompt:
+    """Prompt for templates without source screenshots"""
+    return compiled(TEXT_TO_IMAGE_PROMPT.format(color_start=color_start, color_end=color_end, text=text))
+
+
+@functools.lru_cache(maxsize=PROMPT_CACHE_SIZE)
+def compile_text_edit_prompt(text: str, position: Any) -> CompiledPrompt:
+    """Prompt for re-editing only the caption of an existing preview"""
+    return compiled(f'text overlay "{text}" positioned at the {position}, {QUALITY_PROMPT}')
+
+
+PROMPT_CACHES = (scene_prompt, _generation_prompt, _showcase_prompt, compile_backdrop_prompt,
+                 compile_text_to_image_prompt, compile_text_edit_prompt)
+
+
+def prompt_cache_stats() -> Dict[str, Any]:
+    infos = [cache.cache_info() for cache in PROMPT_CACHES]
+    hits = sum(info.hits for info in infos)
+    misses = sum(info.misses for info in infos)
+    return {
+        "entries": sum(info.currsize for info in infos),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+
+OUTPUT_SIZES = {
+    "app-store": (1290, 2796),
+    "play-store": (1080, 1920),
+    "ipad": (2048, 2732),
+}
 
 
 def get_output_size(size_preset: str) -> tuple:
     """Get output dimensions"""
-    sizes = {
-        "app-store": (1290, 2796),
-        "play-store": (1080, 1920),
-        "ipad": (2048, 2732),
+    return OUTPUT_SIZES.get(size_preset, (1290, 2796))
+
+
+# Locales are used in preview IDs and export folder names
+LOCALE_PATTERN = re.compile(r"^[A-Za-z]{2,3}([-_][A-Za-z0-9]{2,8})*$")
+
+
+# Multi-size fan-out: one master generation, other presets derived locally
+
+# Share of the master's width or height that may be cropped away before padding instead
+FANOUT_MAX_CROP = float(os.getenv("FANOUT_MAX_CROP", "0.15"))
+
+
+def master_size_preset(presets: List[str]) -> str:
+    """The preset with the most pixels, which the others are derived from"""
+    return max(presets, key=lambda preset: get_output_size(preset)[0] * get_output_size(preset)[1])
+
+
+def salient_offset(image: Image.Image, window: int, horizontal: bool) -> int:
+    """Start of the crop window along one axis that keeps the most edge detail.
+
+    Edges are measured on a small grayscale copy; ties go to the centre.
+    """
+    length = image.width if horizontal else image.height
+    if window >= length:
+        return 0
+    scale = 128 / max(image.size)
+    small = image.convert("L").resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR)
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    # Collapse to one row (or column) of mean edge strength
+    profile = list(edges.resize((edges.width, 1) if horizontal else (1, edges.height), Image.BOX).getdata())
+    # FIND_EDGES lights up the image border itself
+    profile[0] = profile[-1] = 0
+    steps = len(profile)
+    span = max(1, round(window / length * steps))
+    best, best_score = 0, None
+    running = sum(profile[:span])
+    for start in range(steps - span + 1):
+        if start:
+            running += profile[start + span - 1] - profile[start - 1]
+        centre_bias = -abs(start - (steps - span) / 2) * 1e-3
+        if best_score is None or running + centre_bias > best_score:
+            best, best_score = start, running + centre_bias
+    return min(length - window, round(best / steps * length))
+
+
+def derive_size(master_path: Path, size: tuple, output_path: Path):
+    """Fit a master render to another size.
+
+    Crops toward the most detailed region, by at most FANOUT_MAX_CROP of the
+    master along the cropped axis, then pads what is left over by stretching
+    the image's outer edge so the background stays continuous.
+    """
+    with Image.open(master_path) as master:
+        image = master.convert("RGB")
+    width, height = size
+    target_ratio = width / height
+
+    if image.width / image.height > target_ratio:
+        crop_width = max(round(image.height * target_ratio), round(image.width * (1 - FANOUT_MAX_CROP)))
+        left = salient_offset(image, crop_width, horizontal=True)
+        image = image.crop((left, 0, left + crop_width, image.height))
+    else:
+        crop_height = max(round(image.width / target_ratio), round(image.height * (1 - FANOUT_MAX_CROP)))
+        top = salient_offset(image, crop_height, horizontal=False)
+        image = image.crop((0, top, image.width, top + crop_height))
+
+    scale = min(width / image.width, height / image.height)
+    fitted = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS, reducing_gap=3.0)
+    canvas = Image.new("RGB", (width, height))
+    x, y = (width - fitted.width) // 2, (height - fitted.height) // 2
+    if y:
+        canvas.paste(fitted.crop((0, 0, fitted.width, 1)).resize((fitted.width, y)), (x, 0))
+        bottom = height - y - fitted.height
+        canvas.paste(fitted.crop((0, fitted.height - 1, fitted.width, fitted.height)).resize((fitted.width, bottom)), (x, y + fitted.height))
+    if x:
+        canvas.paste(fitted.crop((0, 0, 1, fitted.height)).resize((x, fitted.height)), (0, y))
+        right = width - x - fitted.width
+        canvas.paste(fitted.crop((fitted.width - 1, 0, fitted.width, fitted.height)).resize((right, fitted.height)), (x + fitted.width, y))
+    canvas.paste(fitted, (x, y))
+    canvas.save(output_path, "PNG", optimize=False, compress_level=3)
+
+
+# Local compositor: renders what compile_generation_prompt describes on the CPU
+
+RENDER_MODES = ("flux", "local", "local+flux-polish")
+
+# Used with a low strength on a locally composed preview
+FLUX_POLISH_PROMPT = "Polish this app store preview: photorealistic device frame materials, natural lighting and soft shadows. Keep the layout, colors, screenshot content and text exactly as they are. Professional, clean, modern app store aesthetic, high quality"
+
+# Bezel thickness and corner radius as a fraction of the device width
+DEVICE_FRAMES = {
+    "iphone-15-pro": {"bezel": 0.035, "radius": 0.16, "color": (32, 32, 34)},
+    "iphone-15": {"bezel": 0.04, "radius": 0.16, "color": (44, 44, 48)},
+    "android": {"bezel": 0.03, "radius": 0.08, "color": (24, 24, 24)},
+    "ipad": {"bezel": 0.045, "radius": 0.05, "color": (40, 40, 42)},
+}
+
+# Text overlay font sizes are given for an app-store (1290px wide) canvas
+TEXT_REFERENCE_WIDTH = 1290
+
+FONT_CANDIDATES = [
+    os.getenv("COMPOSITOR_FONT", ""),
+    "DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "arialbd.ttf",
+]
+
+# Used instead for captions with Chinese, Japanese or Korean characters
+CJK_FONT_CANDIDATES = [
+    os.getenv("COMPOSITOR_FONT_CJK", ""),
+    "NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/System/Library/Fonts/PingFang.ttc",
+    "msyhbd.ttc",
+]
+CJK_PATTERN = re.compile("[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def hex_to_rgb(color: str, default=(102, 126, 234)) -> tuple:
+    """Parse #rgb / #rrggbb, falling back to default for anything else"""
+    value = (color or "").lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    try:
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return default
+
+
+_font_cache: Dict[tuple, Any] = {}
+
+
+def load_font(size: int, cjk: bool = False):
+    """Bold TrueType font at the given pixel size, memoized"""
+    font = _font_cache.get((size, cjk))
+    if font is None:
+        for candidate in (CJK_FONT_CANDIDATES if cjk else []) + FONT_CANDIDATES:
+            if not candidate:
+                continue
+            try:
+                font = ImageFont.truetype(candidate, size)
+                break
+            except OSError:
+                continue
+        else:
+            font = ImageFont.load_default(size=size)
+        _font_cache[(size, cjk)] = font
+    return font
+
+
+def render_background(size: tuple, background_type: str, background_config: Dict[str, Any], background_image: Optional[Path] = None) -> Image.Image:
+    """Gradient, solid or image background at the canvas size"""
+    width, height = size
+    if background_type == "image" and background_image:
+        with Image.open(background_image) as bg:
+            return ImageOps.fit(bg.convert("RGB"), size, Image.LANCZOS)
+    if background_type == "solid":
+        return Image.new("RGB", size, hex_to_rgb(background_config.get("color", "#667eea")))
+
+    # Gradient (also the fallback for prompt-only backgrounds such as ai-generated)
+    colors = background_config.get("colors") or ["#667eea", "#764ba2"]
+    start = Image.new("RGB", size, hex_to_rgb(colors[0]))
+    end = Image.new("RGB", size, hex_to_rgb(colors[-1]))
+    mask = Image.linear_gradient("L").resize(size, Image.BILINEAR)
+    return Image.composite(end, start, mask)
+
+
+def render_device(screenshot: Image.Image, device_frame: Optional[str], height: int) -> Image.Image:
+    """Screenshot inside a device bezel with rounded corners, `height` pixels tall"""
+    frame = DEVICE_FRAMES.get(device_frame) if device_frame and device_frame != "none" else None
+    if frame is None:
+        frame = {"bezel": 0.0, "radius": 0.05, "color": (0, 0, 0)}
+
+    # Solve width = (height - 2 * bezel) * aspect + 2 * bezel with bezel = width * frame["bezel"]
+    aspect = screenshot.width / screenshot.height
+    width = int(height * aspect / (1 + 2 * frame["bezel"] * (aspect - 1)))
+    bezel = int(width * frame["bezel"])
+    radius = int(width * frame["radius"])
+    screen_size = (max(1, width - 2 * bezel), max(1, height - 2 * bezel))
+
+    device = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    if bezel:
+        body_mask = Image.new("L", device.size, 0)
+        ImageDraw.Draw(body_mask).rounded_rectangle((0, 0, width - 1, height - 1), radius=radius, fill=255)
+        device.paste(Image.new("RGBA", device.size, frame["color"] + (255,)), (0, 0), body_mask)
+
+    screen = ImageOps.fit(screenshot.convert("RGBA"), screen_size, Image.LANCZOS)
+    screen_mask = Image.new("L", screen_size, 0)
+    ImageDraw.Draw(screen_mask).rounded_rectangle(
+        (0, 0, screen_size[0] - 1, screen_size[1] - 1), radius=max(0, radius - bezel), fill=255
+    )
+    device.paste(screen, (bezel, bezel), screen_mask)
+    return device
+
+
+def wrap_text(text: str, font, max_width: int) -> List[str]:
+    """Greedy word wrap to max_width pixels.
+
+    Words too wide for a line on their own, such as unspaced CJK text, are
+    broken between characters.
+    """
+    lines: List[str] = []
+    for word in text.split():
+        if lines and font.getlength(f"{lines[-1]} {word}") <= max_width:
+            lines[-1] = f"{lines[-1]} {word}"
+        elif font.getlength(word) <= max_width:
+            lines.append(word)
+        else:
+            lines.append("")
+            for char in word:
+                if lines[-1] and font.getlength(lines[-1] + char) > max_width:
+                    lines.append(char)
+                else:
+                    lines[-1] += char
+    return lines
+
+
+def layout_text(text_overlay: Optional[Dict[str, Any]], size: tuple) -> Optional[Dict[str, Any]]:
+    """Font, wrapped lines and block height for a text overlay on this canvas"""
+    if not text_overlay or not text_overlay.get("text"):
+        return None
+    width, _ = size
+    font_size = int(text_overlay.get("font_size", 80) * width / TEXT_REFERENCE_WIDTH)
+    font = load_font(font_size, cjk=bool(CJK_PATTERN.search(text_overlay["text"])))
+    lines = wrap_text(text_overlay["text"], font, int(width * 0.86))
+    line_height = int(font_size * 1.2)
+    return {
+        "font": font,
+        "lines": lines,
+        "line_height": line_height,
+        "height": line_height * len(lines),
+        "margin": int(width * 0.08),
+        "position": text_overlay.get("position", "top"),
+        "color": hex_to_rgb(text_overlay.get("color", "#FFFFFF"), default=(255, 255, 255)),
     }
-    return sizes.get(size_preset, (1290, 2796))
+
+
+def paste_layer(canvas: Image.Image, layer: Image.Image, position: tuple):
+    """alpha_composite layer onto canvas at position, clipping at the edges"""
+    left, top = position
+    crop = (max(0, -left), max(0, -top), min(layer.width, canvas.width - left), min(layer.height, canvas.height - top))
+    if crop[0] >= crop[2] or crop[1] >= crop[3]:
+        return
+    canvas.alpha_composite(layer.crop(crop), (left + crop[0], top + crop[1]))
+
+
+def draw_text(canvas: Image.Image, layout: Dict[str, Any]):
+    """Draw a laid-out text overlay with a soft shadow"""
+    width, height = canvas.size
+    if layout["position"] == "bottom":
+        top = height - layout["margin"] - layout["height"]
+    elif layout["position"] == "center":
+        top = (height - layout["height"]) // 2
+    else:
+        top = layout["margin"]
+
+    # Only the band holding the text is drawn and blurred, not the whole canvas
+    pad = layout["line_height"] // 2
+    band_size = (width, layout["height"] + 2 * pad)
+    text_layer = Image.new("RGBA", band_size, (0, 0, 0, 0))
+    shadow_layer = Image.new("RGBA", band_size, (0, 0, 0, 0))
+    text_draw = ImageDraw.Draw(text_layer)
+    shadow_draw = ImageDraw.Draw(shadow_layer)
+    offset = max(2, layout["line_height"] // 24)
+    for i, line in enumerate(layout["lines"]):
+        y = pad + i * layout["line_height"]
+        x = (width - layout["font"].getlength(line)) / 2
+        shadow_draw.text((x + offset, y + offset), line, font=layout["font"], fill=(0, 0, 0, 110))
+        text_draw.text((x, y), line, font=layout["font"], fill=layout["color"] + (255,))
+
+    paste_layer(canvas, shadow_layer.filter(ImageFilter.GaussianBlur(offset * 2)), (0, top - pad))
+    paste_layer(canvas, text_layer, (0, top - pad))
+
+
+def drop_shadow(layer: Image.Image) -> tuple:
+    """Blurred drop shadow for an RGBA layer, computed at quarter resolution.
+
+    Returns the shadow and the padding added around the layer so the blur
+    isn't clipped at its edges.
+    """
+    small = layer.getchannel("A").resize((max(1, layer.width // 4), max(1, layer.height // 4)), Image.BILINEAR)
+    radius = max(2, small.width // 14)
+    padded = Image.new("L", (small.width + 6 * radius, small.height + 6 * radius), 0)
+    padded.paste(small, (3 * radius, 3 * radius))
+    blur = padded.filter(ImageFilter.GaussianBlur(radius))
+    pad = 3 * radius * layer.width // small.width
+    size = (layer.width + 2 * pad, layer.height + 2 * pad)
+    alpha = blur.resize(size, Image.BILINEAR).point(lambda a: a * 45 // 100)
+    shadow = Image.new("RGBA", size, (0, 0, 0, 255))
+    shadow.putalpha(alpha)
+    return shadow, pad
+
+
+def composite_preview(
+    screenshot_path: Path,
+    size: tuple,
+    device_frame: Optional[str],
+    background_type: str,
+    background_config: Dict[str, Any],
+    positioning: Dict[str, Any],
+    text_overlay: Optional[Dict[str, Any]] = None,
+    background_image: Optional[Path] = None,
+    draw_caption: bool = True,
+) -> Image.Image:
+    """Render a preview deterministically without calling fal.ai.
+
+    With draw_caption=False the room for text_overlay is still reserved but
+    the text itself is left out, for captions drawn later.
+    """
+    width, height = size
+    canvas = render_background(size, background_type, background_config, background_image).convert("RGBA")
+
+    # Reserve room for the caption so the device doesn't sit under it
+    layout = layout_text(text_overlay, size)
+    text_space = layout["height"] + 2 * layout["margin"] if layout and layout["position"] != "center" else 0
+    if layout and layout["position"] == "bottom":
+        area_top = 0
+    else:
+        area_top = text_space
+
+    scale = positioning.get("scale", 0.85)
+    device_height = max(1, int((height - text_space) * scale))
+    with Image.open(screenshot_path) as screenshot:
+        device = render_device(screenshot, device_frame, device_height)
+
+    rotation = positioning.get("rotation", 0)
+    if rotation:
+        device = device.rotate(-rotation, resample=Image.BICUBIC, expand=True)
+
+    center_x = width // 2 + int(positioning.get("x_offset", 0))
+    center_y = area_top + (height - text_space) // 2 + int(positioning.get("y_offset", 0))
+    left = center_x - device.width // 2
+    top = center_y - device.height // 2
+
+    if positioning.get("reflection", False):
+        reflection = ImageOps.flip(device)
+        fade = Image.linear_gradient("L").rotate(180).resize(reflection.size).point(lambda a: a * 30 // 100)
+        fade = ImageChops.multiply(fade, reflection.getchannel("A"))
+        reflection.putalpha(fade)
+        paste_layer(canvas, reflection, (left, top + device.height + height // 100))
+
+    if positioning.get("shadow", True):
+        shadow, pad = drop_shadow(device)
+        paste_layer(canvas, shadow, (left - pad, top - pad + device.height // 40))
+
+    paste_layer(canvas, device, (left, top))
+
+    if layout and draw_caption:
+        draw_text(canvas, layout)
+    return canvas.convert("RGB")
+
+
+def render_local_preview(request: "GenerationRequest", screenshot_path: Path, text_overlay: Optional[Dict[str, Any]], output_path: Path, output_size: Optional[str] = None, draw_caption: bool = True):
+    """Render a GenerationRequest screenshot with the local compositor and save it as PNG"""
+    background_image = None
+    if request.background_type == "image":
+        background_image = find_upload(request.background_config.get("image_id"), prefix="bg_")
+    image = composite_preview(
+        screenshot_path,
+        get_output_size(output_size or request.output_size),
+        request.device_frame,
+        request.background_type,
+        request.background_config,
+        request.positioning,
+        text_overlay,
+        background_image,
+        draw_caption,
+    )
+    image.save(output_path, "PNG", optimize=False, compress_level=3)
+
+
+# Saves can send JSON-patch ops instead of the whole project. Ops are appended
+# to the project's revisions.jsonl and folded into project.json once
+# PROJECT_COMPACT_EVERY revisions have piled up; the last PROJECT_REVISIONS
+# stay in the log as history.
+PROJECT_REVISIONS = int(os.getenv("PROJECT_REVISIONS", "50"))
+PROJECT_COMPACT_EVERY = int(os.getenv("PROJECT_COMPACT_EVERY", "20"))
+PROJECT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,100}$")
+PROJECT_META_FIELDS = ("id", "created_at", "updated_at", "revision")
+
+
+def pointer_escape(key: str) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def pointer_parts(path: str) -> List[str]:
+    """Split an RFC 6901 JSON pointer into unescaped keys"""
+    if not isinstance(path, str) or (path and not path.startswith("/")):
+        raise ValueError(f"Invalid JSON pointer: {path!r}")
+    if not path:
+        return []
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def pointer_index(container: list, key: str, allow_end: bool = False) -> int:
+    if allow_end and key == "-":
+        return len(container)
+    if not key.isdigit():
+        raise ValueError(f"Invalid list index: {key!r}")
+    index = int(key)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise ValueError(f"List index out of range: {index}")
+    return index
+
+
+def apply_patch(doc: Any, ops: List[Dict[str, Any]]) -> Any:
+    """Apply RFC 6902 add/replace/remove ops to doc in place and return it"""
+    for op in ops:
+        kind = op.get("op") if isinstance(op, dict) else None
+        if kind not in ("add", "replace", "remove"):
+            raise ValueError(f"Unsupported patch op: {kind!r}")
+        if kind != "remove" and "value" not in op:
+            raise ValueError(f"Patch op {kind} needs a value")
+        parts = pointer_parts(op.get("path"))
+        if not parts:
+            raise ValueError("Patch ops cannot target the whole project")
+
+        parent = doc
+        for key in parts[:-1]:
+            if isinstance(parent, list):
+                parent = parent[pointer_index(parent, key)]
+            elif isinstance(parent, dict) and key in parent:
+                parent = parent[key]
+            else:
+                raise ValueError(f"Path not found: {op['path']}")
+
+        key = parts[-1]
+        if isinstance(parent, list):
+            index = pointer_index(parent, key, allow_end=(kind == "add"))
+            if kind == "add":
+                parent.insert(index, op["value"])
+            elif kind == "replace":
+                parent[index] = op["value"]
+            else:
+                del parent[index]
+        elif isinstance(parent, dict):
+            if kind == "add":
+                parent[key] = op["value"]
+            elif key not in parent:
+                raise ValueError(f"Path not found: {op['path']}")
+            elif kind == "replace":
+                parent[key] = op["value"]
+            else:
+                del parent[key]
+        else:
+            raise ValueError(f"Path not found: {op['path']}")
+    return doc
+
+
+def diff_json(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """JSON-patch ops turning old into new; objects are diffed key by key, lists replaced whole"""
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{"op": "remove", "path": f"{path}/{pointer_escape(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            child = f"{path}/{pointer_escape(key)}"
+            if key not in old:
+                ops.append({"op": "add", "path": child, "value": value})
+            else:
+                ops += diff_json(old[key], value, child)
+        return ops
+    if old == new:
+        return []
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def compact_json(data: Any) -> str:
+    return json.dumps(data, separators=(",", ":"))
+
+
+def write_atomic(path: Path, text: str):
+    """Write to a temp file, fsync and rename over path so readers never see a partial file"""
+    tmp_path = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+class ProjectStore:
+    """Projects as a project.json snapshot plus an append-only revisions.jsonl.
+
+    A patch save appends one line to the log, so its cost follows the size of
+    the edit. Revisions newer than the snapshot are replayed on load. Saves to
+    one project are serialized with a per-project lock; on_commit runs under
+    it, so anything it writes lands in revision order.
+    """
+
+    def __init__(self, root: Path, keep_revisions: int, compact_every: int):
+        self.root = root
+        self.keep_revisions = keep_revisions
+        self.compact_every = max(1, compact_every)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, project_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(project_id, threading.Lock())
+
+    def project_dir(self, project_id: str) -> Path:
+        if not PROJECT_ID_PATTERN.match(project_id or ""):
+            raise ValueError("Invalid project id")
+        return self.root / project_id
+
+    def _read_log(self, project_dir: Path) -> List[Dict[str, Any]]:
+        revisions = []
+        try:
+            with open(project_dir / "revisions.jsonl", "r") as f:
+                for line in f:
+                    try:
+                        revisions.append(json.loads(line))
+                    except ValueError:
+                        # A crash mid-append leaves a torn last line; the save it belonged to never returned
+                        print(f"⚠️  Skipping torn revision in {project_dir.name}")
+        except FileNotFoundError:
+            pass
+        return revisions
+
+    def _read(self, project_dir: Path) -> tuple:
+        """Current project, its revision log, and the revision the snapshot is at"""
+        with open(project_dir / "project.json", "r") as f:
+            project = json.load(f)
+        project.setdefault("revision", 0)
+        snapshot_revision = project["revision"]
+        revisions = self._read_log(project_dir)
+        for entry in revisions:
+            if entry["revision"] > project["revision"]:
+                apply_patch(project, entry["ops"])
+                project["revision"] = entry["revision"]
+                project["updated_at"] = entry["at"]
+        return project, revisions, snapshot_revision
+
+    def _commit(self, project_dir: Path, project: Dict[str, Any], revisions: List[Dict[str, Any]],
+                entry: Dict[str, Any], compact: bool):
+        if not compact:
+            with open(project_dir / "revisions.jsonl", "ab+") as f:
+                line = compact_json(entry).encode() + b"\n"
+                if f.seek(0, os.SEEK_END):
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        # Close off a torn line so this revision doesn't get glued onto it
+                        line = b"\n" + line
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            return
+        # Snapshot first: if we crash before the log is trimmed, its entries are all <= the snapshot and ignored
+        write_atomic(project_dir / "project.json", compact_json(project))
+        history = (revisions + [entry])[-self.keep_revisions:] if self.keep_revisions > 0 else []
+        write_atomic(project_dir / "revisions.jsonl", "".join(compact_json(r) + "\n" for r in history))
+
+    @staticmethod
+    def _check_base(project: Dict[str, Any], base_revision: Optional[int]):
+        if base_revision is not None and base_revision != project["revision"]:
+            raise HTTPException(
+                status_code=409,
+                detail=f"Project is at revision {project['revision']}, not {base_revision}",
+            )
+
+    def load(self, project_id: str) -> Optional[Dict[str, Any]]:
+        project_dir = self.project_dir(project_id)
+        with self._lock(project_id):
+            try:
+                return self._read(project_dir)[0]
+            except FileNotFoundError:
+                return None
+
+    def save(self, project_id: str, fields: Dict[str, Any], base_revision: Optional[int] = None,
+             on_commit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Replace a project's fields (creating it if needed), keeping created_at"""
+        project_dir = self.project_dir(project_id)
+        now = datetime.now().isoformat()
+        with self._lock(project_id):
+            try:
+                current, revisions, _ = self._read(project_dir)
+            except FileNotFoundError:
+                current, revisions = None, []
+            if current is None:
+                project_dir.mkdir(parents=True, exist_ok=True)
+                current = {"id": project_id, "created_at": now, "revision": 0}
+            self._check_base(current, base_revision)
+
+            ops = diff_json({key: current.get(key) for key in fields}, fields)
+            project = {**current, **fields, "revision": current["revision"] + 1, "updated_at": now}
+            entry = {"revision": project["revision"], "at": now, "ops": ops}
+            self._commit(project_dir, project, revisions, entry, compact=True)
+            if on_commit:
+                on_commit(project)
+            return project
+
+    def patch(self, project_id: str, ops: List[Dict[str, Any]], base_revision: Optional[int] = None,
+              on_commit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Apply JSON-patch ops to a saved project"""
+        project_dir = self.project_dir(project_id)
+        for op in ops:
+            parts = pointer_parts(op.get("path") if isinstance(op, dict) else None)
+            if parts and parts[0] in PROJECT_META_FIELDS:
+                raise ValueError(f"{parts[0]} cannot be patched")
+        now = datetime.now().isoformat()
+        with self._lock(project_id):
+            project, revisions, snapshot_revision = self._read(project_dir)
+            self._check_base(project, base_revision)
+            try:
+                apply_patch(project, ops)
+            except (KeyError, IndexError, TypeError) as e:
+                raise ValueError(f"Patch does not apply: {e}") from e
+            project["revision"] += 1
+            project["updated_at"] = now
+            entry = {"revision": project["revision"], "at": now, "ops": ops}
+            pending = project["revision"] - snapshot_revision
+            self._commit(project_dir, project, revisions, entry, compact=pending >= self.compact_every)
+            if on_commit:
+                on_commit(project)
+            return project
+
+    def revisions(self, project_id: str) -> List[Dict[str, Any]]:
+        project_dir = self.project_dir(project_id)
+        with self._lock(project_id):
+            return self._read_log(project_dir)
+
+
+project_store = ProjectStore(PROJECTS_DIR, PROJECT_REVISIONS, PROJECT_COMPACT_EVERY)
+
+
+class ProjectCatalog:
+    """SQLite summary of every project for listing without reading project.json files.
+
+    project_store stays the source of truth; save_project keeps the catalog
+    in step, and an empty catalog is rebuilt from PROJECTS_DIR on startup.
+    """
+
+    THUMBNAILS = 3
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS projects (
+                project_id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                template_id INTEGER,
+                screenshot_count INTEGER NOT NULL,
+                thumbnails TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS projects_updated ON projects (updated_at, project_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS projects_template_updated ON projects (template_id, updated_at, project_id)")
+        if conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0] == 0:
+            self.rebuild()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_sqlite(self.path)
+            conn.row_factory = sqlite3.Row
+        return conn
+
+    def rebuild(self):
+        count = 0
+        for project_file in PROJECTS_DIR.glob("*/project.json"):
+            try:
+                self.put(project_store.load(project_file.parent.name))
+                count += 1
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️  Skipping unreadable project {project_file.parent.name}: {e}")
+        if count:
+            print(f"📇 Indexed {count} existing projects")
+
+    def put(self, project_data: Dict[str, Any]):
+        screenshots = project_data.get("screenshots") or []
+        thumbnails = [
+            {"preview_id": s.get("preview_id"), "caption": s.get("caption")}
+            for s in screenshots[:self.THUMBNAILS] if isinstance(s, dict)
+        ]
+        self._conn().execute(
+            "INSERT OR REPLACE INTO projects VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                project_data["id"],
+                project_data.get("name", ""),
+                project_data.get("template_id"),
+                len(screenshots),
+                json.dumps(thumbnails),
+                project_data.get("created_at", ""),
+                project_data.get("updated_at", ""),
+            ),
+        )
+
+    def list(self, limit: int, cursor: Optional[str] = None, template_id: Optional[int] = None) -> tuple:
+        """One page of summaries, newest first, and the cursor for the next page"""
+        where, params = [], []
+        if template_id is not None:
+            where.append("template_id = ?")
+            params.append(template_id)
+        if cursor:
+            updated_at, project_id = decode_cursor(cursor)
+            where.append("(updated_at < ? OR (updated_at = ? AND project_id < ?))")
+            params += [updated_at, updated_at, project_id]
+        sql = "SELECT * FROM projects"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY updated_at DESC, project_id DESC LIMIT ?"
+        rows = self._conn().execute(sql, (*params, limit + 1)).fetchall()
+
+        projects = [
+            {
+                "id": row["project_id"],
+                "name": row["name"],
+                "template_id": row["template_id"],
+                "screenshot_count": row["screenshot_count"],
+                "thumbnails": json.loads(row["thumbnails"]),
+                "created_at": row["created_at"],
+                "updated_at": row["updated_at"],
+            }
+            for row in rows[:limit]
+        ]
+        next_cursor = None
+        if len(rows) > limit:
+            last = projects[-1]
+            next_cursor = encode_cursor(last["updated_at"], last["id"])
+        return projects, next_cursor
+
+
+def encode_cursor(updated_at: str, project_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([updated_at, project_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        updated_at, project_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(updated_at), str(project_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+project_catalog = ProjectCatalog(USER_DATA_DIR / "projects.db")
 
 
 class SaveProjectRequest(BaseModel):
     project_id: Optional[str]
-    name: str
-    template_id: Optional[int]
-    screenshots: list
-    settings: dict
+    name: Optional[str] = None
+    template_id: Optional[int] = None
+    screenshots: Optional[list] = None
+    settings: Optional[dict] = None
     screenshot_edits: Optional[dict] = None
+    patch: Optional[List[Dict[str, Any]]] = None  # JSON-patch ops against the saved project, instead of the fields above
+    base_revision: Optional[int] = None  # Reject with 409 if the project has moved past this revision
 
 
 @app.post("/api/save-project")
 async def save_project(request: SaveProjectRequest):
-    """Save edited template as a project"""
+    """Save edited template as a project, either whole or as a JSON patch"""
+    # The catalog row is written under the project lock, so concurrent saves can't land out of order
     try:
-        import json
-
-        # Generate project ID if new
-        project_id = request.project_id or f"project_{int(time.time() * 1000)}"
-        project_dir = PROJECTS_DIR / project_id
-        project_dir.mkdir(exist_ok=True)
-
-        # Save project metadata
-        project_data = {
-            "id": project_id,
-            "name": request.name,
-            "template_id": request.template_id,
-            "screenshots": request.screenshots,
-            "settings": request.settings,
-            "screenshot_edits": request.screenshot_edits or {},
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-
-        with open(project_dir / "project.json", "w") as f:
-            json.dump(project_data, f, indent=2)
+        if request.patch is not None:
+            if not request.project_id:
+                raise HTTPException(status_code=400, detail="patch needs a project_id")
+            project_data = await run_blocking(functools.partial(
+                project_store.patch, request.project_id, request.patch, request.base_revision, on_commit=project_catalog.put
+            ))
+        else:
+            if request.name is None or request.screenshots is None or request.settings is None:
+                raise HTTPException(status_code=400, detail="name, screenshots and settings are required")
+            # Generate project ID if new
+            project_id = request.project_id or f"project_{int(time.time() * 1000)}"
+            fields = {
+                "name": request.name,
+                "template_id": request.template_id,
+                "screenshots": request.screenshots,
+                "settings": request.settings,
+                "screenshot_edits": request.screenshot_edits or {},
+            }
+            project_data = await run_blocking(functools.partial(
+                project_store.save, project_id, fields, request.base_revision, on_commit=project_catalog.put
+            ))
 
+        if request.patch is not None:
+            # The client already has the content it patched; skip echoing the whole project back
+            project_data = {key: project_data.get(key) for key in ("id", "name", "revision", "created_at", "updated_at")}
         return {
             "success": True,
             "project": project_data
         }
+    except HTTPException:
+        raise
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Project not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/projects")
-async def get_projects():
-    """Get all saved projects"""
-    try:
-        import json
-
-        projects = []
-        for project_dir in PROJECTS_DIR.iterdir():
-            if project_dir.is_dir():
-                project_file = project_dir / "project.json"
-                if project_file.exists():
-                    with open(project_file, "r") as f:
-                        project_data = json.load(f)
-                        projects.append(project_data)
+async def get_projects(limit: int = 50, cursor: Optional[str] = None, template_id: Optional[int] = None):
+    """List saved projects, most recently updated first.
+
+    Summaries only; fetch /api/project/{id} for screenshots and edits. Pass
+    next_cursor back as cursor for the following page.
+    """
+    limit = max(1, min(limit, 200))
+    projects, next_cursor = await run_blocking(project_catalog.list, limit, cursor, template_id)
+    return {
+        "success": True,
+        "projects": projects,
+        "next_cursor": next_cursor
+    }
 
-        # Sort by updated_at descending
-        projects.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
 
-        return {
-            "success": True,
-            "projects": projects
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+def load_project(project_id: str) -> Dict[str, Any]:
+    """A saved project; 404 for a malformed id or a missing project, 500 if its files are corrupt"""
+    if not PROJECT_ID_PATTERN.match(project_id or ""):
+        raise HTTPException(status_code=404, detail="Project not found")
+    try:
+        project_data = project_store.load(project_id)
+    except ValueError as e:
+        # The id is valid, so this is project.json failing to decode
+        print(f"❌ Project {project_id} is unreadable: {e}")
+        raise HTTPException(status_code=500, detail=f"Project data is unreadable: {e}")
+    if project_data is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+    return project_data
 
 
 @app.get("/api/project/{project_id}")
 async def get_project(project_id: str):
     """Get a specific project"""
-    try:
-        import json
-
-        project_dir = PROJECTS_DIR / project_id
-        project_file = project_dir / "project.json"
+    project_data = await run_blocking(load_project, project_id)
+    return {
+        "success": True,
+        "project": project_data
+    }
 
-        if not project_file.exists():
-            raise HTTPException(status_code=404, detail="Project not found")
 
-        with open(project_file, "r") as f:
-            project_data = json.load(f)
+@app.get("/api/project/{project_id}/revisions")
+async def get_project_revisions(project_id: str):
+    """A project's recent revisions as JSON-patch ops, oldest first"""
+    await run_blocking(load_project, project_id)
+    revisions = await run_blocking(project_store.revisions, project_id)
+    return {
+        "success": True,
+        "revisions": revisions
+    }
 
-        return {
-            "success": True,
-            "project": project_data
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/project/{project_id}/export")
+async def export_project(project_id: str, naming: str = "plain"):
+    """Download a project's generated previews as one ZIP"""
+    if naming not in ("plain", "store"):
+        raise HTTPException(status_code=400, detail="naming must be plain or store")
+    project_data = await run_blocking(load_project, project_id)
+    screenshots = project_data.get("screenshots") or []
+    previews = [(s["preview_id"], "") for s in screenshots if isinstance(s, dict) and s.get("preview_id")]
+    files = await run_blocking(export_files, previews)
+    return zip_response(files, naming, f"{project_id}.zip")
 
 if __name__ == "__main__":
     import uvicorn
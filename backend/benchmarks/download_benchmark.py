@@ -0,0 +1,112 @@
+"""Compare buffered vs streamed downloads of generated images.
+
+Serves a PNG-sized random payload from a local HTTP server and downloads it
+with N concurrent threads, once with the old bare requests.get(...).content
+approach and once with app.download_file. Each mode runs in its own process
+so peak RSS is measured independently.
+
+    python benchmarks/download_benchmark.py [--size-mb 8] [--concurrency 10] [--rounds 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from memory import peak_rss_mb
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def serve_payload(size: int) -> ThreadingHTTPServer:
+    payload = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_mode(mode: str, size_mb: int, concurrency: int, rounds: int) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="download-bench-"))
+    os.chdir(workdir)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import requests
+    import app
+
+    server = serve_payload(size_mb * 1024 * 1024)
+    url = f"http://127.0.0.1:{server.server_port}/image.png"
+
+    def buffered(i: int):
+        response = requests.get(url)
+        with open(workdir / f"{i}.png", "wb") as f:
+            f.write(response.content)
+
+    def streamed(i: int):
+        app.download_file(url, workdir / f"{i}.png")
+
+    download = buffered if mode == "buffered" else streamed
+    baseline = peak_rss_mb()
+    total = concurrency * rounds
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(download, range(total)))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "mode": mode,
+        "downloads": total,
+        "seconds": round(elapsed, 3),
+        "throughput_mb_s": round(total * size_mb / elapsed, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(baseline, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--mode", choices=["buffered", "streamed"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.size_mb, args.concurrency, args.rounds)))
+        return
+
+    print(f"{args.concurrency} concurrent downloads of {args.size_mb} MB x {args.rounds} rounds")
+    print(f"{'mode':<10} {'seconds':>8} {'MB/s':>8} {'peak RSS MB':>12}")
+    for mode in ("buffered", "streamed"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--size-mb", str(args.size_mb),
+             "--concurrency", str(args.concurrency), "--rounds", str(args.rounds)],
+            check=True, capture_output=True, text=True,
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        print(f"{mode:<10} {result['seconds']:>8} {result['throughput_mb_s']:>8} {result['peak_rss_mb']:>12}")
+
+
+if __name__ == "__main__":
+    main()
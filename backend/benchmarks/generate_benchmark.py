@@ -0,0 +1,358 @@
+"""Throughput of /api/generate end to end against a local fal.ai stand-in.
+
+Runs the real FastAPI app under uvicorn in this process with fal_client
+replaced by a mock: uploads, the fal queue (submit, status, result) and the
+generated image URL are served locally with lognormal latencies and
+configurable failure rates, so no fal credits are spent. N concurrent jobs of
+M screenshots each are uploaded, generated and polled until they finish.
+
+    python benchmarks/generate_benchmark.py [--jobs 10] [--screenshots 5] [--inference-ms 3000] [--failure-rate 0.02]
+
+App settings such as FAL_POLL_INTERVAL, BLOCKING_WORKERS or
+SCHEDULER_PER_JOB_LIMIT are read from the environment as usual.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from memory import peak_rss_mb
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def latency(median_ms: float, jitter: float) -> float:
+    """Seconds drawn from a lognormal distribution around median_ms"""
+    if median_ms <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median_ms / 1000), jitter) if jitter else median_ms / 1000
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def png_bytes(size: tuple, seed: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle([x, y, x + size[0] // 4, y + size[1] // 8], fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def serve_image(payload: bytes, download_ms: float, jitter: float) -> ThreadingHTTPServer:
+    """Stand-in for the fal.ai CDN: every GET returns the same generated image"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency(download_ms, jitter))
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MockFal:
+    """Replaces the fal_client calls the app makes with local, timed fakes.
+
+    Each submitted request is queued for a queue_ms draw, then in progress
+    for an inference_ms draw. failure_rate of requests fail when their
+    result is fetched; status_error_rate of status polls raise, exercising
+    the poller's retries.
+    """
+
+    def __init__(self, args, image_url: str):
+        self.args = args
+        self.image_url = image_url
+        self.uploads = 0
+        self.submitted = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._requests = {}
+
+    def install(self, fal_client):
+        fal_client.upload_file = self.upload_file
+        fal_client.submit_async = self.submit_async
+        fal_client.result_async = self.result_async
+
+    def upload_file(self, path: str, **kwargs) -> str:
+        time.sleep(latency(self.args.upload_ms, self.args.jitter))
+        self.uploads += 1
+        return f"https://fal.media/mock/{uuid.uuid4().hex}.png"
+
+    async def submit_async(self, application: str, arguments: dict):
+        import fal_client
+
+        await asyncio.sleep(latency(self.args.submit_ms, self.args.jitter))
+        now = time.monotonic()
+        started = now + latency(self.args.queue_ms, self.args.jitter)
+        request = {
+            "started": started,
+            "completed": started + latency(self.args.inference_ms, self.args.jitter),
+            "fail": random.random() < self.args.failure_rate,
+        }
+        request_id = uuid.uuid4().hex
+        self._requests[request_id] = request
+        self.submitted += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        mock = self
+
+        class Handle:
+            def __init__(self):
+                self.request_id = request_id
+
+            async def status(self):
+                if random.random() < mock.args.status_error_rate:
+                    raise ConnectionError("mock status error")
+                now = time.monotonic()
+                if now < request["started"]:
+                    return fal_client.Queued(position=0)
+                if now < request["completed"]:
+                    return fal_client.InProgress(logs=None)
+                return fal_client.Completed(logs=None, metrics={})
+
+            async def cancel(self):
+                mock._done(request_id)
+
+        return Handle()
+
+    async def result_async(self, application: str, request_id: str) -> dict:
+        request = self._done(request_id)
+        if request and request["fail"]:
+            self.failed += 1
+            raise RuntimeError("mock fal failure")
+        return {"images": [{"url": self.image_url}]}
+
+    def _done(self, request_id: str):
+        request = self._requests.pop(request_id, None)
+        if request:
+            self.in_flight -= 1
+        return request
+
+
+class ThreadSampler:
+    """Samples how many of the app's blocking-work threads are busy"""
+
+    def __init__(self, app, interval: float = 0.02):
+        self.app = app
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append(min(self.app.BLOCKING_WORKERS, self.app.executor_pending))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(app, port: int):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def run_job(base_url: str, job: int, args) -> dict:
+    import requests
+
+    session = requests.Session()
+    files = [
+        ("files", (f"job{job}_{i}.png", png_bytes((390, 844), job * 1000 + i), "image/png"))
+        for i in range(args.screenshots)
+    ]
+    upload = session.post(f"{base_url}/api/upload", files=files, timeout=120)
+    upload.raise_for_status()
+    screenshots = [{"id": f["id"], "textOverlay": {"text": f"Screenshot {i + 1}"}} for i, f in enumerate(upload.json()["files"])]
+
+    body = {
+        "screenshots": screenshots,
+        "background_config": {"colors": ["#667eea", "#764ba2"]},
+        "render_mode": args.render_mode,
+    }
+    started = time.perf_counter()
+    response = session.post(f"{base_url}/api/generate", json=body, timeout=120)
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        status = session.get(f"{base_url}/api/status/{job_id}", timeout=120).json()
+        if status["status"] in ("completed", "failed"):
+            break
+        time.sleep(args.poll_ms / 1000)
+    elapsed = time.perf_counter() - started
+
+    results = status.get("results") or []
+    return {
+        "seconds": elapsed,
+        "status": status["status"],
+        "screenshots": len(results),
+        "failed": sum(1 for r in results if "error" in r),
+        "timings": [r["timings"] for r in results if "timings" in r and "error" not in r],
+    }
+
+
+def run(args) -> dict:
+    workdir = Path(tempfile.mkdtemp(prefix="generate-bench-"))
+    os.chdir(workdir)
+    os.environ["FAL_KEY"] = "benchmark"
+    os.environ.setdefault("TEMPLATE_PREUPLOAD", "0")
+    os.environ.setdefault("TEMPLATE_PREWARM", "0")
+    sys.path.insert(0, str(BACKEND_DIR))
+    random.seed(args.seed)
+
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        import fal_client
+        import app
+
+        image_server = serve_image(png_bytes(app.get_output_size("app-store"), 0), args.download_ms, args.jitter)
+        fal = MockFal(args, f"http://127.0.0.1:{image_server.server_port}/image.png")
+        fal.install(fal_client)
+        port = free_port()
+        server, server_thread = start_app(app, port)
+        base_url = f"http://127.0.0.1:{port}"
+
+        baseline_rss = peak_rss_mb()
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        with ThreadSampler(app) as sampler, ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            jobs = list(pool.map(lambda job: run_job(base_url, job, args), range(args.jobs)))
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_before
+
+        server.should_exit = True
+        server_thread.join(timeout=10)
+        image_server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = [job["seconds"] for job in jobs]
+    stages = {}
+    for job in jobs:
+        for timings in job["timings"]:
+            for name, seconds in timings.items():
+                stages.setdefault(name, []).append(seconds)
+    busy = sampler.samples or [0]
+    return {
+        "jobs": args.jobs,
+        "screenshots_per_job": args.screenshots,
+        "render_mode": args.render_mode,
+        "seconds": round(elapsed, 3),
+        "jobs_per_min": round(args.jobs / elapsed * 60, 1),
+        "screenshots_per_min": round(args.jobs * args.screenshots / elapsed * 60, 1),
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "failed_jobs": sum(1 for job in jobs if job["status"] != "completed"),
+        "failed_screenshots": sum(job["failed"] for job in jobs),
+        "fal_submitted": fal.submitted,
+        "fal_failed": fal.failed,
+        "fal_peak_in_flight": fal.peak_in_flight,
+        "fal_uploads": fal.uploads,
+        "threads": app.BLOCKING_WORKERS,
+        "threads_busy_avg": round(sum(busy) / len(busy), 2),
+        "threads_busy_peak": max(busy),
+        "thread_utilization": round(sum(busy) / len(busy) / app.BLOCKING_WORKERS, 3),
+        "cpu_utilization": round(cpu / elapsed, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "rss_before_mb": round(baseline_rss, 1),
+        "stages_p50_s": {name: round(percentile(values, 50), 3) for name, values in sorted(stages.items())},
+        "stages_p95_s": {name: round(percentile(values, 95), 3) for name, values in sorted(stages.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=10, help="concurrent jobs")
+    parser.add_argument("--screenshots", type=int, default=5, help="screenshots per job")
+    parser.add_argument("--render-mode", default="flux", choices=["flux", "local", "local+flux-polish"])
+    parser.add_argument("--upload-ms", type=float, default=200, help="median fal upload latency")
+    parser.add_argument("--submit-ms", type=float, default=100, help="median fal queue submit latency")
+    parser.add_argument("--queue-ms", type=float, default=500, help="median time queued at fal")
+    parser.add_argument("--inference-ms", type=float, default=3000, help="median FLUX inference time")
+    parser.add_argument("--download-ms", type=float, default=100, help="median time to first byte of the image")
+    parser.add_argument("--jitter", type=float, default=0.4, help="lognormal sigma of every latency, 0 for fixed")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of fal requests that fail")
+    parser.add_argument("--status-error-rate", type=float, default=0.0, help="fraction of fal status polls that raise")
+    parser.add_argument("--poll-ms", type=float, default=250, help="client /api/status poll interval")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's own logging")
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result))
+        return
+
+    print(f"{result['jobs']} concurrent jobs x {result['screenshots_per_job']} screenshots, "
+          f"render_mode={result['render_mode']}, {result['seconds']}s")
+    print(f"{'latency':<12} p50 {result['p50_s']}s  p95 {result['p95_s']}s  p99 {result['p99_s']}s")
+    print(f"{'throughput':<12} {result['jobs_per_min']} jobs/min, {result['screenshots_per_min']} screenshots/min")
+    print(f"{'failures':<12} {result['failed_jobs']} jobs, {result['failed_screenshots']} screenshots "
+          f"({result['fal_failed']} of {result['fal_submitted']} fal requests)")
+    print(f"{'fal':<12} peak {result['fal_peak_in_flight']} in flight, {result['fal_uploads']} uploads")
+    print(f"{'threads':<12} {result['threads_busy_avg']} of {result['threads']} busy on average, "
+          f"peak {result['threads_busy_peak']} ({result['thread_utilization']:.0%}); CPU {result['cpu_utilization']:.0%}")
+    print(f"{'memory':<12} peak RSS {result['peak_rss_mb']} MB ({result['rss_before_mb']} MB before the run)")
+    print(f"{'stage':<16} {'p50 s':>8} {'p95 s':>8}")
+    for name, p50 in result["stages_p50_s"].items():
+        print(f"{name:<16} {p50:>8} {result['stages_p95_s'][name]:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""The app served by uvicorn from a scratch directory, with fal.ai faked out"""
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class FakeFal:
+    """Stands in for fal_client. Uploads or inference block until gate is set."""
+
+    def __init__(self, image_path: Path):
+        self.image_path = image_path
+        self.block = "upload"
+        self.gate = threading.Event()
+        self.blocked = threading.Event()
+
+    def upload_file(self, path, **kwargs):
+        if self.block == "upload":
+            self.blocked.set()
+            self.gate.wait(30)
+        return f"https://fal.media/test/{uuid.uuid4().hex}.png"
+
+    async def submit_async(self, application, arguments):
+        import fal_client
+
+        fake = self
+
+        class Handle:
+            request_id = uuid.uuid4().hex
+
+            async def status(self):
+                if fake.block == "inference" and not fake.gate.is_set():
+                    fake.blocked.set()
+                    return fal_client.InProgress(logs=None)
+                return fal_client.Completed(logs=None, metrics={})
+
+            async def cancel(self):
+                pass
+
+        return Handle()
+
+    async def result_async(self, application, request_id):
+        return {"images": [{"url": "https://fal.media/test/result.png"}]}
+
+    def download_file(self, url, output_path, session=None):
+        shutil.copyfile(self.image_path, output_path)
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("backend")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ.update(FAL_KEY="test", TEMPLATE_PREUPLOAD="0", TEMPLATE_PREWARM="0", FAL_POLL_INTERVAL="0.05")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import app
+
+    yield app
+    os.chdir(cwd)
+
+
+@pytest.fixture
+def fake_fal(app_module, monkeypatch, tmp_path):
+    import fal_client
+    from PIL import Image
+
+    image_path = tmp_path / "result.png"
+    Image.new("RGB", (64, 128), "purple").save(image_path)
+    fake = FakeFal(image_path)
+    monkeypatch.setattr(fal_client, "upload_file", fake.upload_file)
+    monkeypatch.setattr(fal_client, "submit_async", fake.submit_async)
+    monkeypatch.setattr(fal_client, "result_async", fake.result_async)
+    monkeypatch.setattr(app_module, "download_file", fake.download_file)
+    yield fake
+    fake.gate.set()
+
+
+@pytest.fixture(scope="session")
+def server(app_module):
+    """Base URL of the app running under uvicorn on a background thread"""
+    import uvicorn
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        assert thread.is_alive(), "uvicorn failed to start"
+        time.sleep(0.05)
+    yield f"http://127.0.0.1:{port}"
+    uvicorn_server.should_exit = True
+    thread.join(timeout=10)
@@ -0,0 +1,43 @@
+"""DELETE /api/cleanup/{job_id} removes every file a job wrote"""
+import io
+import time
+
+import httpx
+from PIL import Image
+
+
+def test_cleanup_removes_sizes_and_locales(server, app_module):
+    screenshot = io.BytesIO()
+    Image.new("RGB", (390, 844), "teal").save(screenshot, "PNG")
+    with httpx.Client(base_url=server, timeout=30) as client:
+        upload = client.post("/api/upload", files={"files": ("shot.png", screenshot.getvalue(), "image/png")})
+        assert upload.status_code == 200
+        screenshot_id = upload.json()["files"][0]["id"]
+
+        response = client.post("/api/generate", json={
+            "screenshots": [{"id": screenshot_id}],
+            "render_mode": "local",
+            "output_sizes": ["app-store", "play-store"],
+            "captions": {"en": ["Track everything"], "de": ["Alles im Blick"]},
+        })
+        assert response.status_code == 200
+        job_id = response.json()["job_id"]
+
+        deadline = time.time() + 30
+        while (job := client.get(f"/api/status/{job_id}").json())["status"] not in ("completed", "failed"):
+            assert time.time() < deadline, "job never finished"
+            time.sleep(0.1)
+        assert job["status"] == "completed", job.get("error")
+
+        result = job["results"][0]
+        preview_ids = [result["preview_id"]]
+        preview_ids += [size["preview_id"] for size in result["sizes"].values()]
+        for locale in result["locales"].values():
+            preview_ids += [size["preview_id"] for size in locale["sizes"].values()]
+        # Two sizes, each text-free and in two locales
+        assert len(set(preview_ids)) == 6
+        assert all(app_module.find_output(preview_id) for preview_id in preview_ids)
+
+        assert client.delete(f"/api/cleanup/{job_id}").status_code == 200
+        assert [p for p in preview_ids if app_module.find_output(p)] == []
+        assert client.get(f"/api/status/{job_id}").status_code == 404
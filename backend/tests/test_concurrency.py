@@ -0,0 +1,43 @@
+"""/api/status keeps answering while template previews are stuck in fal.ai"""
+import threading
+import time
+
+import httpx
+import pytest
+
+# A status poll is a single job lookup; anything slower means it waited on generation
+STATUS_LATENCY = 0.5
+
+
+# Template previews are kept once generated, so each case uses templates of its own
+@pytest.mark.parametrize("block, polled_template, waited_template", [("upload", 2, 1), ("inference", 4, 3)])
+def test_status_responsive_while_template_preview_blocks(server, fake_fal, block, polled_template, waited_template):
+    fake_fal.block = block
+    response = httpx.post(f"{server}/api/generate-template-preview", json={"template_id": polled_template, "background": True})
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+
+    # The blocking variant holds its request open until every preview is done
+    results = {}
+
+    def generate():
+        results["response"] = httpx.post(f"{server}/api/generate-template-preview", json={"template_id": waited_template}, timeout=60)
+
+    generation = threading.Thread(target=generate)
+    generation.start()
+    try:
+        assert fake_fal.blocked.wait(10), f"generation never reached the fake {block}"
+        with httpx.Client(base_url=server, timeout=5) as client:
+            for _ in range(10):
+                started = time.perf_counter()
+                status = client.get(f"/api/status/{job_id}")
+                elapsed = time.perf_counter() - started
+                assert status.status_code == 200
+                assert status.json()["status"] in ("queued", "processing")
+                assert elapsed < STATUS_LATENCY, f"/api/status took {elapsed:.2f}s during a blocked {block}"
+    finally:
+        fake_fal.gate.set()
+        generation.join(60)
+
+    assert results["response"].status_code == 200
+    assert len(results["response"].json()["previews"]) == 5
@@ -2,6 +2,7 @@ import React, { useState, useEffect, useRef } from 'react';
 import { Sparkles, Upload as UploadIcon, Settings, Wand2, Download, Edit2, X, Smartphone, Type, Image as ImageIcon, Palette, Maximize2, Languages } from 'lucide-react';
 import useAppStore from './store/useAppStore';
 import { api } from './api/client';
+import { conflictingPaths, diffJson } from './api/jsonPatch';
 
 // Template presets
 const TEMPLATES = [
@@ -125,6 +126,7 @@ function App() {
   const [currentProject, setCurrentProject] = useState(null);
   const [projectName, setProjectName] = useState('');
   const [savedProjects, setSavedProjects] = useState([]);
+  const [projectsCursor, setProjectsCursor] = useState(null);
   const [editorSettings, setEditorSettings] = useState({
     device: 'iphone-15-pro',
     text: '',
@@ -184,7 +186,9 @@ function App() {
         setGeneratingTemplatePreviews(prev => ({ ...prev, [templateId]: true }));
 
         try {
-          const response = await api.generateTemplatePreview(templateId);
+          const response = await api.generateTemplatePreview(templateId, {
+            onResults: (previews) => setTemplatePreviews(prev => ({ ...prev, [templateId]: previews })),
+          });
           setTemplatePreviews(prev => ({ ...prev, [templateId]: response.previews }));
         } catch (error) {
           console.error(`Failed to load template ${templateId}:`, error);
@@ -198,28 +202,45 @@ function App() {
     loadProjects();
   }, []); // Only run once on mount
 
-  // Poll for job status
+  // Follow job progress over server-sent events
   useEffect(() => {
     if (!currentJob) return;
 
-    const pollInterval = setInterval(async () => {
+    const events = new EventSource(api.getJobEventsUrl(currentJob));
+    const mergeStatus = (e) => {
+      const changes = JSON.parse(e.data);
+      delete changes.result;
+      setJobStatus((prev) => ({ ...prev, ...changes }));
+    };
+
+    // A job that is already over gets only a snapshot, so both events can end it
+    const handleStatus = async (e) => {
+      const { status } = JSON.parse(e.data);
+      if (status !== 'completed' && status !== 'failed') {
+        mergeStatus(e);
+        return;
+      }
+
+      events.close();
       try {
-        const status = await api.getJobStatus(currentJob);
-        setJobStatus(status);
-
-        if (status.status === 'completed') {
-          setGeneratedPreviews(status.results);
-          clearInterval(pollInterval);
-        } else if (status.status === 'failed') {
-          alert('Generation failed: ' + status.error);
-          clearInterval(pollInterval);
+        // Fetch the final job once for the ordered results
+        const job = await api.getJobStatus(currentJob);
+        setJobStatus(job);
+        if (job.status === 'completed') {
+          setGeneratedPreviews(job.results);
+        } else {
+          alert('Generation failed: ' + job.error);
         }
       } catch (error) {
         console.error('Failed to fetch status:', error);
       }
-    }, 2000);
+    };
+
+    events.addEventListener('snapshot', handleStatus);
+    events.addEventListener('progress', mergeStatus);
+    events.addEventListener('status', handleStatus);
 
-    return () => clearInterval(pollInterval);
+    return () => events.close();
   }, [currentJob, setJobStatus, setGeneratedPreviews]);
 
   const handleFileUpload = async (e) => {
@@ -319,27 +340,20 @@ function App() {
     setGeneratingCaptions(generatingState);
 
     try {
-      // Generate all captions concurrently
-      const promises = screenshots.map(screenshot =>
-        api.generateCaption(screenshot.id)
-          .then(result => {
-            if (result.success) {
-              updateScreenshotText(screenshot.id, {
-                text: result.caption,
-                position: result.position,
-                font_size: result.font_size,
-                color: result.color,
-              });
-            }
-            return { id: screenshot.id, success: true };
-          })
-          .catch(error => {
-            console.error(`Failed to generate caption for ${screenshot.id}:`, error);
-            return { id: screenshot.id, success: false };
-          })
-      );
-
-      await Promise.all(promises);
+      // One batched request; captions stream back as each one finishes
+      await api.generateCaptions(screenshots.map(s => s.id), (result) => {
+        if (result.success) {
+          updateScreenshotText(result.screenshot_id, {
+            text: result.caption,
+            position: result.position,
+            font_size: result.font_size,
+            color: result.color,
+          });
+        } else {
+          console.error(`Failed to generate caption for ${result.screenshot_id}:`, result.error);
+        }
+        setGeneratingCaptions(prev => ({ ...prev, [result.screenshot_id]: false }));
+      });
     } catch (error) {
       console.error('Failed to generate all captions:', error);
     } finally {
@@ -428,7 +442,7 @@ function App() {
     const template = TEMPLATES.find(t => (t.backendTemplateId || t.id) === templateId);
 
     // If already have previews, just show them
-    if (templatePreviews[templateId]) {
+    if (templatePreviews[templateId] && !generatingTemplatePreviews[templateId]) {
       setViewingTemplatePreview({
         id: templateId,
         previews: templatePreviews[templateId],
@@ -441,18 +455,19 @@ function App() {
     // Generate previews
     setGeneratingTemplatePreviews(prev => ({ ...prev, [templateId]: true }));
     try {
-      const result = await api.generateTemplatePreview(templateId);
-      if (result.success) {
-        setTemplatePreviews(prev => ({
-          ...prev,
-          [templateId]: result.previews
-        }));
+      // Open the viewer with the first preview and fill it in as the rest finish
+      const showPreviews = (previews) => {
+        setTemplatePreviews(prev => ({ ...prev, [templateId]: previews }));
         setViewingTemplatePreview({
           id: templateId,
-          previews: result.previews,
+          previews,
           name: template?.name || 'Template',
           description: template?.description || ''
         });
+      };
+      const result = await api.generateTemplatePreview(templateId, { onResults: showPreviews });
+      if (result.success) {
+        showPreviews(result.previews);
       }
     } catch (error) {
       alert('Failed to generate template previews: ' + error.message);
@@ -751,35 +766,75 @@ function App() {
         };
       });
 
-      const response = await fetch('http://localhost:8000/api/save-project', {
+      const fields = {
+        name: projectName,
+        template_id: editingTemplate.backendTemplateId,
+        screenshots: screenshotsWithSettings,
+        screenshot_edits: screenshotEdits,
+        settings: {
+          device: editorSettings.device,
+          backgroundType: editorSettings.backgroundType,
+          backgroundConfig: editorSettings.backgroundType === 'gradient'
+            ? { colors: editorSettings.gradientColors }
+            : { color: editorSettings.solidColor },
+          positioning: editingTemplate.settings.positioning
+        }
+      };
+
+      const postSave = (body) => fetch('http://localhost:8000/api/save-project', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({
-          project_id: currentProject?.id || null,
-          name: projectName,
-          template_id: editingTemplate.backendTemplateId,
-          screenshots: screenshotsWithSettings,
-          screenshot_edits: screenshotEdits,
-          settings: {
-            device: editorSettings.device,
-            backgroundType: editorSettings.backgroundType,
-            backgroundConfig: editorSettings.backgroundType === 'gradient'
-              ? { colors: editorSettings.gradientColors }
-              : { color: editorSettings.solidColor },
-            positioning: editingTemplate.settings.positioning
-          }
-        })
+        body: JSON.stringify(body)
       });
 
+      const pickFields = (project) => {
+        const picked = {};
+        Object.keys(fields).forEach((key) => { picked[key] = project[key] ?? null; });
+        return picked;
+      };
+
+      // Saved projects only send what changed since the last save
+      let response;
+      let baseRevision = currentProject?.revision;
+      if (currentProject?.id && baseRevision !== undefined) {
+        const before = pickFields(currentProject);
+        const patch = diffJson(before, fields);
+        response = await postSave({ project_id: currentProject.id, base_revision: baseRevision, patch });
+
+        // Saved elsewhere in the meantime: reapply our changes on top of theirs,
+        // unless both sides changed the same thing
+        if (response.status === 409) {
+          const latest = await fetchProject(currentProject.id);
+          if (!latest) return;
+          baseRevision = latest.revision;
+          const conflicts = conflictingPaths(patch, diffJson(before, pickFields(latest)));
+          if (conflicts.length === 0) {
+            response = await postSave({ project_id: currentProject.id, base_revision: baseRevision, patch });
+          } else if (window.confirm(
+            `This project was changed elsewhere since you opened it (${conflicts.join(', ')}). ` +
+            'Overwrite those changes with yours?'
+          )) {
+            response = await postSave({ project_id: currentProject.id, base_revision: baseRevision, ...fields });
+          } else {
+            alert('Project not saved. Reopen it from My Projects to see the other changes.');
+            return;
+          }
+        }
+      }
+      // New projects, and patches the backend rejects as malformed, fall back to a full save
+      if (!response || response.status === 400) {
+        response = await postSave({ project_id: currentProject?.id || null, base_revision: baseRevision, ...fields });
+      }
+
       const result = await response.json();
       if (result.success) {
-        setCurrentProject(result.project);
+        setCurrentProject({ ...fields, ...result.project });
         setDirtyScreenshots(new Set()); // Clear dirty state after save
         alert('Project saved successfully!');
         // Refresh projects list
         loadProjects();
       } else {
-        alert('Failed to save project: ' + result.error);
+        alert('Failed to save project: ' + (result.detail || result.error));
       }
     } catch (error) {
       alert('Failed to save project: ' + error.message);
@@ -788,18 +843,33 @@ function App() {
     }
   };
 
-  const loadProjects = async () => {
+  const loadProjects = async (cursor = null) => {
     try {
-      const response = await fetch('http://localhost:8000/api/projects');
+      const params = new URLSearchParams({ limit: 60 });
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`http://localhost:8000/api/projects?${params}`);
       const result = await response.json();
       if (result.success) {
-        setSavedProjects(result.projects);
+        setSavedProjects(prev => (cursor ? [...prev, ...result.projects] : result.projects));
+        setProjectsCursor(result.next_cursor);
       }
     } catch (error) {
       console.error('Failed to load projects:', error);
     }
   };
 
+  // The projects list only has summaries; fetch the full project to view or edit it
+  const fetchProject = async (projectId) => {
+    try {
+      const response = await fetch(`http://localhost:8000/api/project/${projectId}`);
+      const result = await response.json();
+      return result.success ? result.project : null;
+    } catch (error) {
+      alert('Failed to load project: ' + error.message);
+      return null;
+    }
+  };
+
   // Show results page when job exists
   if (currentJob && jobStatus) {
     return (
@@ -823,7 +893,7 @@ function App() {
         <main className="max-w-6xl mx-auto px-6 py-8">
           <div className="bg-white/5 backdrop-blur-md rounded-2xl border border-white/10 p-8">
             <h2 className="text-3xl font-bold mb-4">Your Generated Previews</h2>
-            {jobStatus.status === 'processing' && (
+            {(jobStatus.status === 'processing' || jobStatus.status === 'queued') && (
               <div className="flex items-center gap-3">
                 <div className="animate-spin rounded-full h-8 w-8 border-b-2 border-white"></div>
                 <span>
@@ -837,7 +907,7 @@ function App() {
                   {generatedPreviews.map((preview, i) => (
                     <div key={preview.preview_id} className="bg-white/5 rounded-xl p-4">
                       <img
-                        src={`${api.getDownloadUrl(preview.preview_id)}?t=${preview.timestamp || Date.now()}`}
+                        src={api.getPreviewUrl(preview.preview_id, { width: 640, version: preview.timestamp })}
                         alt={`Preview ${i + 1}`}
                         className="w-full rounded-lg shadow-lg mb-4"
                       />
@@ -986,7 +1056,7 @@ function App() {
                 {template.hasExamples && templatePreviews[template.backendTemplateId] ? (
                   <div className="w-full h-24 rounded-lg mb-2 overflow-hidden bg-black/20">
                     <img
-                      src={api.getDownloadUrl(templatePreviews[template.backendTemplateId][0].preview_id)}
+                      src={api.getPreviewUrl(templatePreviews[template.backendTemplateId][0].preview_id, { width: 320 })}
                       alt={template.name}
                       className="w-full h-full object-cover"
                     />
@@ -1099,7 +1169,7 @@ function App() {
                           >
                             <div className="relative aspect-[9/19.5] mb-3">
                               <img
-                                src={api.getDownloadUrl(preview.preview_id)}
+                                src={api.getPreviewUrl(preview.preview_id, { width: 640 })}
                                 alt={preview.caption}
                                 className="w-full h-full object-cover rounded-xl shadow-2xl"
                               />
@@ -1752,20 +1822,20 @@ function App() {
                         >
                           {/* Project Preview */}
                           <div className="aspect-video bg-gradient-to-br from-purple-900/50 to-blue-900/50 p-4 flex items-center justify-center">
-                            {project.screenshots && project.screenshots.length > 0 ? (
+                            {project.thumbnails && project.thumbnails.length > 0 ? (
                               <div className="flex gap-2 overflow-hidden">
-                                {project.screenshots.slice(0, 3).map((screenshot, idx) => (
+                                {project.thumbnails.map((screenshot, idx) => (
                                   <div key={idx} className="w-16 flex-shrink-0">
                                     <img
-                                      src={screenshot.preview || api.getDownloadUrl(screenshot.preview_id)}
+                                      src={api.getPreviewUrl(screenshot.preview_id, { width: 160 })}
                                       alt={`Screenshot ${idx + 1}`}
                                       className="w-full rounded-lg shadow-lg"
                                     />
                                   </div>
                                 ))}
-                                {project.screenshots.length > 3 && (
+                                {project.screenshot_count > project.thumbnails.length && (
                                   <div className="w-16 flex-shrink-0 bg-white/10 rounded-lg flex items-center justify-center">
-                                    <span className="text-xs font-semibold">+{project.screenshots.length - 3}</span>
+                                    <span className="text-xs font-semibold">+{project.screenshot_count - project.thumbnails.length}</span>
                                   </div>
                                 )}
                               </div>
@@ -1781,15 +1851,16 @@ function App() {
                               Based on: {template?.name || 'Custom Upload'}
                             </p>
                             <p className="text-xs text-gray-500 mb-4">
-                              {project.screenshots?.length || 0} screenshots • Updated{' '}
+                              {project.screenshot_count || 0} screenshots • Updated{' '}
                               {new Date(project.updated_at).toLocaleDateString()}
                             </p>
 
                             {/* Action Buttons */}
                             <div className="space-y-2">
                               <button
-                                onClick={() => {
-                                  setViewingProjectPreview(project);
+                                onClick={async () => {
+                                  const fullProject = await fetchProject(project.id);
+                                  if (fullProject) setViewingProjectPreview(fullProject);
                                 }}
                                 className="w-full py-2 bg-blue-600 hover:bg-blue-700 rounded-lg text-sm font-semibold transition-all flex items-center justify-center gap-2"
                               >
@@ -1798,30 +1869,33 @@ function App() {
                               </button>
                               <div className="flex gap-2">
                                 <button
-                                  onClick={() => {
+                                  onClick={async () => {
+                                    const fullProject = await fetchProject(project.id);
+                                    if (!fullProject) return;
+
                                     // Load project into editor
                                     // For uploaded screenshots without a template, create a custom template
                                     const loadedTemplate = template || {
                                       name: 'Custom Upload',
                                       settings: {
-                                        deviceFrame: project.settings?.device || 'iphone-15-pro',
+                                        deviceFrame: fullProject.settings?.device || 'iphone-15-pro',
                                         textPosition: 'top',
-                                        backgroundType: project.settings?.backgroundType || 'gradient',
-                                        backgroundConfig: project.settings?.backgroundConfig || { colors: ['#667eea', '#764ba2'] },
-                                        positioning: project.settings?.positioning || { rotation: 0 }
+                                        backgroundType: fullProject.settings?.backgroundType || 'gradient',
+                                        backgroundConfig: fullProject.settings?.backgroundConfig || { colors: ['#667eea', '#764ba2'] },
+                                        positioning: fullProject.settings?.positioning || { rotation: 0 }
                                       },
                                       backendTemplateId: project.template_id
                                     };
 
                                     setEditingTemplate(loadedTemplate);
-                                    setEditingScreenshots(project.screenshots || []);
+                                    setEditingScreenshots(fullProject.screenshots || []);
                                     setCurrentScreenshotIndex(0);
-                                    setProjectName(project.name);
-                                    setCurrentProject(project);
+                                    setProjectName(fullProject.name);
+                                    setCurrentProject(fullProject);
 
                                     // Restore screenshot edits if available
-                                    if (project.screenshot_edits) {
-                                      setScreenshotEdits(project.screenshot_edits);
+                                    if (fullProject.screenshot_edits) {
+                                      setScreenshotEdits(fullProject.screenshot_edits);
                                     } else {
                                       setScreenshotEdits({});
                                     }
@@ -1830,18 +1904,18 @@ function App() {
                                     setDirtyScreenshots(new Set());
 
                                     // Set editor settings from project
-                                    if (project.settings) {
+                                    if (fullProject.settings) {
                                       setEditorSettings({
-                                        device: project.settings.device || 'iphone-15-pro',
-                                        text: project.screenshots?.[0]?.individual_settings?.text || project.screenshots?.[0]?.caption || '',
-                                        textPosition: project.screenshots?.[0]?.individual_settings?.textPosition || 'top',
-                                        textColor: project.screenshots?.[0]?.individual_settings?.textColor || 'white',
-                                        backgroundType: project.settings.backgroundType || 'gradient',
-                                        gradientColors: project.settings.backgroundConfig?.colors || ['#667eea', '#764ba2'],
-                                        solidColor: project.settings.backgroundConfig?.color || '#ffffff',
+                                        device: fullProject.settings.device || 'iphone-15-pro',
+                                        text: fullProject.screenshots?.[0]?.individual_settings?.text || fullProject.screenshots?.[0]?.caption || '',
+                                        textPosition: fullProject.screenshots?.[0]?.individual_settings?.textPosition || 'top',
+                                        textColor: fullProject.screenshots?.[0]?.individual_settings?.textColor || 'white',
+                                        backgroundType: fullProject.settings.backgroundType || 'gradient',
+                                        gradientColors: fullProject.settings.backgroundConfig?.colors || ['#667eea', '#764ba2'],
+                                        solidColor: fullProject.settings.backgroundConfig?.color || '#ffffff',
                                         backgroundImage: null,
                                         backgroundImageId: null,
-                                        rotation: project.settings.positioning?.rotation ?? 0
+                                        rotation: fullProject.settings.positioning?.rotation ?? 0
                                       });
                                     }
 
@@ -1870,6 +1944,17 @@ function App() {
                     })}
                   </div>
                 )}
+
+                {projectsCursor && (
+                  <div className="text-center mt-6">
+                    <button
+                      onClick={() => loadProjects(projectsCursor)}
+                      className="px-6 py-3 bg-white/10 hover:bg-white/20 rounded-xl font-semibold transition-all"
+                    >
+                      Load more
+                    </button>
+                  </div>
+                )}
               </div>
             </div>
           )}
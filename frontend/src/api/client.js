@@ -38,11 +38,28 @@ export const api = {
     return response.data;
   },
 
+  // Server-sent events stream for job progress
+  getJobEventsUrl: (jobId) => {
+    return `${API_BASE_URL}/api/jobs/${jobId}/events`;
+  },
+
   // Get download URL
   getDownloadUrl: (previewId) => {
     return `${API_BASE_URL}/api/download/${previewId}`;
   },
 
+  // Resized preview for thumbnails; pass a version after a preview is re-edited
+  getPreviewUrl: (previewId, { width = 480, format = 'webp', version } = {}) => {
+    const params = new URLSearchParams({ w: width, format });
+    if (version) params.set('v', version);
+    return `${API_BASE_URL}/api/preview/${previewId}?${params}`;
+  },
+
+  // ZIP of all of a job's previews; naming 'store' groups them by store and device size
+  getJobExportUrl: (jobId, naming = 'plain') => {
+    return `${API_BASE_URL}/api/jobs/${jobId}/export?naming=${naming}`;
+  },
+
   // Cleanup job
   cleanupJob: async (jobId) => {
     const response = await apiClient.delete(`/api/cleanup/${jobId}`);
@@ -55,16 +72,69 @@ export const api = {
     return response.data;
   },
 
+  // Generate captions for several screenshots; onResult gets each NDJSON line as it arrives
+  generateCaptions: async (screenshotIds, onResult) => {
+    const response = await fetch(`${API_BASE_URL}/api/generate-captions`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ screenshot_ids: screenshotIds }),
+    });
+    if (!response.ok) {
+      throw new Error(`Caption generation failed (${response.status})`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.filter(Boolean).forEach((line) => onResult(JSON.parse(line)));
+      if (done) break;
+    }
+    if (buffer.trim()) onResult(JSON.parse(buffer));
+  },
+
   // Edit preview with new caption
   editPreview: async (previewId, textOverlay) => {
     const response = await apiClient.post(`/api/edit-preview/${previewId}`, textOverlay);
     return response.data;
   },
 
-  // Generate template preview
-  generateTemplatePreview: async (templateId) => {
-    const response = await apiClient.post('/api/generate-template-preview', { template_id: templateId });
-    return response.data;
+  // Generate template preview (runs as a background job). onResults gets the
+  // previews finished so far each time more arrive; polling backs off to 5s
+  // and gives up after timeoutMs.
+  generateTemplatePreview: async (templateId, { onResults, timeoutMs = 10 * 60 * 1000 } = {}) => {
+    const response = await apiClient.post('/api/generate-template-preview', {
+      template_id: templateId,
+      background: true,
+    });
+    const jobId = response.data.job_id;
+    const deadline = Date.now() + timeoutMs;
+
+    let delay = 500;
+    let seen = 0;
+    for (;;) {
+      const status = await api.getJobStatus(jobId);
+      const results = status.results || [];
+      if (onResults && results.length > seen) {
+        seen = results.length;
+        onResults(results);
+      }
+      if (status.status === 'completed') {
+        return { success: true, template_id: templateId, previews: results };
+      }
+      if (status.status === 'failed') {
+        throw new Error(status.error);
+      }
+      if (Date.now() + delay > deadline) {
+        throw new Error(`Template preview timed out after ${Math.round(timeoutMs / 1000)}s`);
+      }
+      await new Promise((resolve) => setTimeout(resolve, delay));
+      delay = Math.min(delay * 2, 5000);
+    }
   },
 };
 
@@ -0,0 +1,33 @@
+// JSON-patch (RFC 6902) ops that turn `before` into `after`.
+// Objects are diffed key by key; arrays and other values are replaced whole,
+// which matches what the backend records for full saves.
+const escapeKey = (key) => String(key).replace(/~/g, '~0').replace(/\//g, '~1');
+
+const isObject = (value) => value !== null && typeof value === 'object' && !Array.isArray(value);
+
+export const diffJson = (before, after, path = '') => {
+  if (isObject(before) && isObject(after)) {
+    const ops = [];
+    Object.keys(before).forEach((key) => {
+      if (!(key in after)) ops.push({ op: 'remove', path: `${path}/${escapeKey(key)}` });
+    });
+    Object.keys(after).forEach((key) => {
+      const childPath = `${path}/${escapeKey(key)}`;
+      if (!(key in before)) {
+        ops.push({ op: 'add', path: childPath, value: after[key] });
+      } else {
+        ops.push(...diffJson(before[key], after[key], childPath));
+      }
+    });
+    return ops;
+  }
+  if (JSON.stringify(before) === JSON.stringify(after)) return [];
+  return [{ op: 'replace', path, value: after }];
+};
+
+// True when two JSON pointers touch the same value, or one is inside the other.
+const pathsOverlap = (a, b) => a === b || a.startsWith(`${b}/`) || b.startsWith(`${a}/`);
+
+// Paths changed by both patches, i.e. edits that can't be merged automatically.
+export const conflictingPaths = (ours, theirs) =>
+  ours.filter((op) => theirs.some((other) => pathsOverlap(op.path, other.path))).map((op) => op.path);
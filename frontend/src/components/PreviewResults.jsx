@@ -45,6 +45,10 @@ const PreviewResults = () => {
   };
 
   const handleDownloadAll = () => {
+    if (currentJob) {
+      window.location.href = api.getJobExportUrl(currentJob);
+      return;
+    }
     generatedPreviews.forEach((preview, index) => {
       if (preview.preview_id) {
         setTimeout(() => {
@@ -130,7 +134,7 @@ const PreviewResults = () => {
                 <>
                   <div className="aspect-[9/16] relative">
                     <img
-                      src={api.getDownloadUrl(preview.preview_id)}
+                      src={api.getPreviewUrl(preview.preview_id, { width: 640 })}
                       alt={`Preview ${index + 1}`}
                       className="w-full h-full object-contain bg-gray-50"
                     />
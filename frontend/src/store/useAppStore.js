@@ -68,7 +68,9 @@ const useAppStore = create((set, get) => ({
 
   setCurrentJob: (jobId) => set({ currentJob: jobId }),
 
-  setJobStatus: (status) => set({ jobStatus: status }),
+  setJobStatus: (status) => set((state) => ({
+    jobStatus: typeof status === 'function' ? status(state.jobStatus) : status,
+  })),
 
   setGeneratedPreviews: (previews) => set({ generatedPreviews: previews }),
 